@@ -0,0 +1,60 @@
+"""category notify switch
+
+Revision ID: 4b8e2d61c9a3
+Revises: f15b0e58128d
+Create Date: 2026-10-18 15:02:37.412806
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "4b8e2d61c9a3"
+down_revision: Union[str, Sequence[str], None] = "f15b0e58128d"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# the triggers of 7b7f20cf8099, skipped while a transaction has
+# SET LOCAL category.notify = 'off' (bulk imports notify once at the end)
+NOTIFY_FUNCTION = """
+               CREATE OR REPLACE FUNCTION data_raw_on_{event}() RETURNS TRIGGER AS
+               $$
+               BEGIN
+                   IF current_setting('category.notify', true)
+                          IS DISTINCT FROM 'off' THEN
+                       PERFORM (WITH payload("type", "id") AS (SELECT '{event}', {row}.id)
+                                SELECT pg_notify('category', row_to_json(payload)::TEXT)
+                                FROM payload);
+                   END IF;
+                   RETURN NULL;
+               END
+               $$ LANGUAGE 'plpgsql';
+               """
+
+PREVIOUS_FUNCTION = """
+               CREATE OR REPLACE FUNCTION data_raw_on_{event}() RETURNS TRIGGER AS
+               $$
+               BEGIN
+                   PERFORM (WITH payload("type", "id") AS (SELECT '{event}', {row}.id)
+                            SELECT pg_notify('category', row_to_json(payload)::TEXT)
+                            FROM payload);
+                   RETURN NULL;
+               END
+               $$ LANGUAGE 'plpgsql';
+               """
+
+EVENTS = (("insert", "NEW"), ("edit", "NEW"), ("delete", "old"))
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for event, row in EVENTS:
+        op.execute(NOTIFY_FUNCTION.format(event=event, row=row))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for event, row in EVENTS:
+        op.execute(PREVIOUS_FUNCTION.format(event=event, row=row))
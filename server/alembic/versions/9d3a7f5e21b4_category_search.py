@@ -0,0 +1,72 @@
+"""category search
+
+Revision ID: 9d3a7f5e21b4
+Revises: 4b8e2d61c9a3
+Create Date: 2026-10-18 16:21:09.873154
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "9d3a7f5e21b4"
+down_revision: Union[str, Sequence[str], None] = "4b8e2d61c9a3"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "category",
+        sa.Column("search", postgresql.TSVECTOR(), nullable=True),
+    )
+    # 'simple' doesn't stem, names and articles mix russian and english;
+    # search.search_categories has to use the same configuration
+    op.execute(
+        """
+               CREATE OR REPLACE FUNCTION category_search_vector() RETURNS TRIGGER AS
+               $$
+               BEGIN
+                   NEW.search :=
+                       setweight(to_tsvector('simple', NEW.name), 'A') ||
+                       setweight(to_tsvector('simple', coalesce(NEW.content, '')), 'B');
+                   RETURN NEW;
+               END
+               $$ LANGUAGE 'plpgsql';
+
+               CREATE TRIGGER on_category_search
+                   BEFORE INSERT OR UPDATE OF name, content
+                   ON category
+                   FOR EACH ROW
+               EXECUTE PROCEDURE category_search_vector();
+               """
+    )
+    # fills the column through the trigger, without a notification per row
+    op.execute("SET LOCAL category.notify = 'off'")
+    op.execute("UPDATE category SET name = name")
+    op.execute("SET LOCAL category.notify = 'on'")
+    op.create_index(
+        "ix_category_search",
+        "category",
+        ["search"],
+        unique=False,
+        postgresql_using="gin",
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_category_search", table_name="category", postgresql_using="gin")
+    op.execute(
+        """
+        DROP TRIGGER IF EXISTS on_category_search ON category;
+        DROP FUNCTION IF EXISTS category_search_vector();
+        """
+    )
+    op.drop_column("category", "search")
@@ -0,0 +1,132 @@
+"""category path
+
+Revision ID: f15b0e58128d
+Revises: 77df59fd9a3d
+Create Date: 2026-10-18 13:47:05.918223
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "f15b0e58128d"
+down_revision: Union[str, Sequence[str], None] = "77df59fd9a3d"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "category",
+        sa.Column("path", postgresql.ARRAY(sa.Integer()), nullable=True),
+    )
+    op.execute(
+        """
+        WITH RECURSIVE tree(id, path) AS (
+            SELECT id, ARRAY[id] FROM category WHERE parent_id IS NULL
+            UNION ALL
+            SELECT c.id, tree.path || c.id
+            FROM category c
+            JOIN tree ON c.parent_id = tree.id
+        )
+        UPDATE category SET path = tree.path
+        FROM tree
+        WHERE category.id = tree.id;
+        """
+    )
+    op.alter_column("category", "path", nullable=False)
+    # ordered by path and covering the tree columns, so listing the tree or
+    # a subtree is an index only range scan without a sort
+    op.create_index(
+        "ix_category_path",
+        "category",
+        ["path"],
+        unique=True,
+        postgresql_include=["id", "name", "parent_id"],
+    )
+    op.execute(
+        """
+               CREATE OR REPLACE FUNCTION category_set_path() RETURNS TRIGGER AS
+               $$
+               DECLARE
+                   parent_path INTEGER[];
+               BEGIN
+                   IF NEW.parent_id IS NULL THEN
+                       NEW.path := ARRAY[NEW.id];
+                       RETURN NEW;
+                   END IF;
+
+                   SELECT path INTO parent_path
+                   FROM category
+                   WHERE id = NEW.parent_id;
+
+                   IF parent_path IS NULL THEN
+                       RAISE EXCEPTION 'parent category % does not exist',
+                           NEW.parent_id;
+                   END IF;
+                   IF NEW.id = ANY(parent_path) THEN
+                       RAISE EXCEPTION 'category % can not be moved into its own subtree',
+                           NEW.id;
+                   END IF;
+
+                   NEW.path := parent_path || NEW.id;
+                   RETURN NEW;
+               END
+               $$ LANGUAGE 'plpgsql';
+
+               CREATE TRIGGER on_category_path_insert
+                   BEFORE INSERT
+                   ON category
+                   FOR EACH ROW
+               EXECUTE PROCEDURE category_set_path();
+
+               CREATE TRIGGER on_category_path_move
+                   BEFORE UPDATE OF parent_id
+                   ON category
+                   FOR EACH ROW
+                   WHEN (OLD.parent_id IS DISTINCT FROM NEW.parent_id)
+               EXECUTE PROCEDURE category_set_path();
+               """
+    )
+    op.execute(
+        """
+               CREATE OR REPLACE FUNCTION category_move_subtree() RETURNS TRIGGER AS
+               $$
+               BEGIN
+                   UPDATE category
+                   SET path = NEW.path || path[cardinality(OLD.path) + 1:]
+                   WHERE path @> ARRAY[OLD.id] AND id <> OLD.id;
+                   RETURN NULL;
+               END
+               $$ LANGUAGE 'plpgsql';
+
+               CREATE TRIGGER on_category_path_subtree
+                   AFTER UPDATE OF parent_id
+                   ON category
+                   FOR EACH ROW
+                   WHEN (OLD.parent_id IS DISTINCT FROM NEW.parent_id)
+               EXECUTE PROCEDURE category_move_subtree();
+               """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute(
+        """
+        DROP TRIGGER IF EXISTS on_category_path_insert ON category;
+        DROP TRIGGER IF EXISTS on_category_path_move ON category;
+        DROP TRIGGER IF EXISTS on_category_path_subtree ON category;
+
+        DROP FUNCTION IF EXISTS category_set_path();
+        DROP FUNCTION IF EXISTS category_move_subtree();
+    """
+    )
+    op.drop_index("ix_category_path", table_name="category")
+    op.drop_column("category", "path")
@@ -0,0 +1,199 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+from mimetypes import guess_type
+from typing import Dict, List, Optional
+
+import anyio
+from jinja2 import pass_context
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+try:
+    import brotli
+except ImportError:  # optional, only gzip variants without it
+    brotli = None
+
+# suffixes of the compressed variants, in the order they are preferred
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+# images and fonts are compressed already
+COMPRESSIBLE = {".css", ".js", ".mjs", ".svg", ".html", ".txt", ".json"}
+# a fingerprinted name never changes its content
+IMMUTABLE = "public, max-age=31536000, immutable"
+MANIFEST = "manifest.json"
+
+
+def fingerprint(name: str, content: bytes) -> str:
+    stem, extension = os.path.splitext(name)
+    digest = hashlib.blake2b(content, digest_size=8).hexdigest()
+    return f"{stem}.{digest}{extension}"
+
+
+def compress(content: bytes) -> Dict[str, bytes]:
+    variants = {"gzip": gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(content, quality=11)
+    return {
+        encoding: data
+        for encoding, data in variants.items()
+        if len(data) < len(content)
+    }
+
+
+def write_file(path: str, content: bytes):
+    # named by their content, so a file that's there is the right one;
+    # workers build at the same time, a half written file is never seen
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f"{path}.{os.getpid()}.tmp"
+    with open(partial, "wb") as file:
+        file.write(content)
+    os.replace(partial, path)
+
+
+def build_assets(source: str, target: str) -> dict:
+    # name -> its fingerprinted name and the encodings it has variants in;
+    # older builds stay, pages cached with their names still load them
+    manifest = {}
+    target = os.path.abspath(target)
+    for root, directories, files in os.walk(source):
+        directories[:] = [
+            directory
+            for directory in directories
+            if os.path.abspath(os.path.join(root, directory)) != target
+        ]
+        for filename in files:
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, source).replace(os.sep, "/")
+            with open(path, "rb") as file:
+                content = file.read()
+            hashed = fingerprint(name, content)
+            manifest[name] = {
+                "path": hashed,
+                "encodings": build_file(name, content, target, hashed),
+            }
+    return manifest
+
+
+def build_file(name: str, content: bytes, target: str, hashed: str):
+    # the file itself is written after its variants, once it's there a
+    # build (at build time or by another worker) is complete and nothing
+    # is compressed again
+    if os.path.exists(os.path.join(target, hashed)):
+        return [
+            encoding
+            for encoding, suffix in ENCODINGS.items()
+            if os.path.exists(os.path.join(target, hashed + suffix))
+        ]
+    encodings = []
+    if os.path.splitext(name)[1] in COMPRESSIBLE:
+        variants = compress(content)
+        for encoding, suffix in ENCODINGS.items():
+            if encoding in variants:
+                path = os.path.join(target, hashed + suffix)
+                write_file(path, variants[encoding])
+                encodings.append(encoding)
+    write_file(os.path.join(target, hashed), content)
+    return encodings
+
+
+def negotiate(accept_encoding: str, encodings: List[str]) -> Optional[str]:
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    for encoding in ENCODINGS:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if encoding in encodings and quality > 0:
+            return encoding
+    return None
+
+
+class Assets:
+    def __init__(self, directory: str, manifest: dict):
+        self.directory = directory
+        self.manifest = manifest
+        # fingerprinted name -> encodings
+        entries = manifest.values()
+        self.files = {entry["path"]: entry["encodings"] for entry in entries}
+        # pages link the fingerprinted names, their etags change with it
+        names = "\0".join(sorted(self.files)).encode()
+        self.version = hashlib.blake2b(names, digest_size=8).hexdigest()
+
+    def resolve(self, name: str) -> str:
+        # names that weren't built are served as they are
+        entry = self.manifest.get(name)
+        return entry["path"] if entry is not None else name
+
+    @pass_context
+    def url_for(self, context, name: str, /, **path_params):
+        # url_for of templates, with static files by their built name
+        if name == "static" and "path" in path_params:
+            path_params["path"] = self.resolve(path_params["path"])
+        return context["request"].url_for(name, **path_params)
+
+
+class AssetFiles(StaticFiles):
+    # fingerprinted names come from the built directory, compressed when
+    # the client takes it; the plain names from the static directory
+    def __init__(self, assets: Assets, **kwargs):
+        super().__init__(**kwargs)
+        self.assets = assets
+
+    async def get_response(self, path: str, scope):
+        encodings = self.assets.files.get(path)
+        if encodings is None or scope["method"] not in ("GET", "HEAD"):
+            return await super().get_response(path, scope)
+
+        request_headers = Headers(scope=scope)
+        accept_encoding = request_headers.get("accept-encoding", "")
+        encoding = negotiate(accept_encoding, encodings)
+        variant = path + ENCODINGS[encoding] if encoding else path
+        full_path = os.path.join(self.assets.directory, variant)
+        stat_result = await anyio.to_thread.run_sync(os.stat, full_path)
+        headers = {"Cache-Control": IMMUTABLE}
+        if encodings:
+            headers["Vary"] = "Accept-Encoding"
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        response = FileResponse(
+            full_path,
+            headers=headers,
+            media_type=guess_type(path)[0] or "text/plain",
+            stat_result=stat_result,
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def main():
+    # at build time, the app finds the files in place on startup
+    parser = argparse.ArgumentParser(
+        prog="python -m server.assets",
+        description="Writes fingerprinted and compressed static files.",
+    )
+    parser.add_argument("source")
+    parser.add_argument("target")
+    args = parser.parse_args()
+    manifest = build_assets(args.source, args.target)
+    with open(os.path.join(args.target, MANIFEST), "w") as file:
+        json.dump(manifest, file, indent=2)
+    for name, entry in manifest.items():
+        encodings = ", ".join(entry["encodings"]) or "uncompressed"
+        print(f"{name} -> {entry['path']} ({encodings})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import asyncio
+
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from server.db import engine
+from server.render import render_markdown
+from server.schema import Category
+
+BATCH_SIZE = 100
+
+
+async def backfill_content_html(batch_size: int = BATCH_SIZE) -> int:
+    updated = 0
+    last_id = 0
+    async with AsyncSession(engine) as session:
+        while True:
+            statement = (
+                select(Category)
+                .where(Category.id > last_id)
+                .where(Category.content.is_not(None))
+                .where(Category.content_html.is_(None))
+                .order_by(Category.id)
+                .limit(batch_size)
+            )
+            categories = (await session.exec(statement)).all()
+            if not categories:
+                break
+            for category in categories:
+                category.content_html = render_markdown(category.content)
+            last_id = categories[-1].id
+            updated += len(categories)
+            await session.commit()
+            print(f"Rendered {updated} categories...")
+    return updated
+
+
+if __name__ == "__main__":
+    total = asyncio.run(backfill_content_html())
+    print(f"Backfilled content_html for {total} categories")
@@ -1,22 +1,280 @@
 import asyncio
+import json
+import random
+import time
+from typing import List, Tuple
 
-from server.crud import delete_cache
-from server.db import engine
+import asyncpg
 
+from server import crud, redis_, search
+from server.cache import invalidate_local_cache, local_cache
+from server.settings import Settings
 
-async def listen_notifications() -> None:
-    async with engine.connect() as conn:
-        raw_conn = await conn.get_raw_connection()
-        await raw_conn.driver_connection.add_listener(
-            "category",
-            listener_callback,
+settings = Settings()
+
+# pg_try_advisory_lock key held by the leader's listener connection
+LISTENER_LOCK_KEY = 0x63617465
+FANOUT_CHANNEL = "category:events"
+# what the triggers send, and "reload" after a bulk import
+EVENT_TYPES = {"insert", "edit", "delete"}
+# sent once redis is back in place of the messages it didn't take
+RESYNC_MESSAGE = json.dumps({"resync": True})
+
+
+def next_backoff(delay: float) -> float:
+    return min(delay * 2, settings.LISTENER_BACKOFF_MAX)
+
+
+def parse_event(payload: str) -> dict:
+    event = json.loads(payload)
+    if isinstance(event, dict) and event.get("type") == "reload":
+        return event
+    valid = (
+        isinstance(event, dict)
+        and event.get("type") in EVENT_TYPES
+        and isinstance(event.get("id"), int)
+    )
+    if not valid:
+        raise ValueError(f"Unexpected notification {payload!r}")
+    return event
+
+
+def merge_events(events: List[dict]) -> List[dict]:
+    # one event per category: where it first appeared, with its last type
+    types = {}
+    for event in events:
+        types[event["id"]] = event["type"]
+    return [{"type": kind, "id": cid} for cid, kind in types.items()]
+
+
+def evict_local(events: List[dict]):
+    for event in events:
+        if event["type"] != "insert":
+            local_cache.evict_page(event["id"])
+            local_cache.evict_entry(event["id"])
+
+
+async def update_shared(events: List[dict]):
+    changed = [event["id"] for event in events if event["type"] != "insert"]
+    await crud.evict_category_entries(changed)
+    await crud.apply_category_events(events)
+    await search.invalidate_results()
+
+
+@invalidate_local_cache
+async def apply_notifications(events: List[dict]):
+    evict_local(events)
+    # what was read before the eviction isn't stored, and what is read
+    # from redis until update_shared has dropped it there is evicted again
+    local_cache.generation += 1
+    await update_shared(events)
+    evict_local(events)
+
+
+@invalidate_local_cache
+async def apply_fanout(events: List[dict]):
+    evict_local(events)
+
+
+class NotificationListener:
+    def __init__(self, dsn: str, mode: str):
+        self.dsn = dsn
+        self.leader_mode = mode == "leader"
+        self.queue: asyncio.Queue[Tuple[float, str]] = asyncio.Queue()
+        self.backoff = settings.LISTENER_BACKOFF_MIN
+        # set once the caches of this worker are known to be in sync, what
+        # is cached before that may be dropped
+        self.synced = asyncio.Event()
+        self.stats = {
+            "mode": mode,
+            "leader": False,
+            "connected": False,
+            "subscribed": False,
+            "reconnects": 0,
+            "resyncs": 0,
+            "received": 0,
+            "batches": 0,
+            "failed_batches": 0,
+            "malformed": 0,
+            "restarts": 0,
+            "fanout_received": 0,
+            "lag_seconds_last": 0.0,
+            "lag_seconds_max": 0.0,
+            "last_error": None,
+        }
+
+    def on_notification(self, conn, pid, channel, payload):
+        self.stats["received"] += 1
+        self.queue.put_nowait((time.monotonic(), payload))
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "queue_depth": self.queue.qsize()}
+
+    def failed(self, message: str, error: Exception):
+        self.stats["last_error"] = repr(error)
+        print(f"{message}: {error!r}")
+
+    async def publish(self, message: dict):
+        await redis_.pending.publish(
+            FANOUT_CHANNEL, json.dumps(message), RESYNC_MESSAGE
         )
 
-        print("Listening on channel 'my_channel'...")
+    async def resync(self):
+        try:
+            await crud.resync_cache()
+            await search.invalidate_results()
+            self.stats["resyncs"] += 1
+            if self.leader_mode:
+                await self.publish({"resync": True})
+        except Exception as error:
+            self.failed("Resyncing the cache failed", error)
+
+    async def listen(self) -> bool:
+        # False, after an election interval, when another worker leads
+        conn = await asyncpg.connect(self.dsn)
+        closed = asyncio.Event()
+        conn.add_termination_listener(lambda _: closed.set())
+        try:
+            if self.leader_mode:
+                # held as long as this connection lives, so postgres frees
+                # it when the leader dies or loses its connection
+                self.stats["leader"] = await conn.fetchval(
+                    "SELECT pg_try_advisory_lock($1)", LISTENER_LOCK_KEY
+                )
+                if not self.stats["leader"]:
+                    conn.terminate()
+                    await asyncio.sleep(settings.LISTENER_ELECTION_INTERVAL)
+                    return False
+            await conn.add_listener("category", self.on_notification)
+            # anything changed while nobody was listening is lost, so the
+            # caches are dropped once LISTEN is in place
+            await self.resync()
+            if not self.leader_mode:
+                self.synced.set()
+            self.stats["connected"] = True
+            self.backoff = settings.LISTENER_BACKOFF_MIN
+            print("Listening on channel 'category'...")
+            keepalive = settings.LISTENER_KEEPALIVE
+            while not closed.is_set():
+                try:
+                    await asyncio.wait_for(closed.wait(), keepalive)
+                except asyncio.TimeoutError:
+                    # a dead peer is only noticed when something is sent
+                    await conn.execute("SELECT 1", timeout=keepalive)
+            return True
+        finally:
+            self.stats["connected"] = False
+            self.stats["leader"] = False
+            conn.terminate()
+
+    async def consume(self):
+        while True:
+            first = await self.queue.get()
+            await asyncio.sleep(settings.LISTENER_COALESCE_WINDOW)
+            batch = [first]
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            events = []
+            for _, payload in batch:
+                # anyone can NOTIFY the channel, what isn't ours is skipped
+                try:
+                    events.append(parse_event(payload))
+                except ValueError as error:
+                    self.stats["malformed"] += 1
+                    self.failed("Skipping a notification", error)
+            if not events:
+                continue
+            if any(event["type"] == "reload" for event in events):
+                # a bulk import, everything is reloaded at once
+                await self.resync()
+                continue
+            events = merge_events(events)
+            try:
+                if self.leader_mode:
+                    await update_shared(events)
+                    await self.publish({"events": events})
+                else:
+                    await apply_notifications(events)
+            except Exception as error:
+                self.stats["failed_batches"] += 1
+                self.failed("Applying notifications failed", error)
+                await self.resync()
+                continue
+            self.stats["batches"] += 1
+            lag = time.monotonic() - first[0]
+            self.stats["lag_seconds_last"] = lag
+            if lag > self.stats["lag_seconds_max"]:
+                self.stats["lag_seconds_max"] = lag
+
+    async def subscribe(self):
+        # leader mode: every worker, the leader too, drops its local tiers
+        # on what the leader publishes
+        backoff = settings.LISTENER_BACKOFF_MIN
         while True:
-            await asyncio.sleep(1)
+            pubsub = redis_.pubsub_client.pubsub()
+            try:
+                await pubsub.subscribe(FANOUT_CHANNEL)
+                self.stats["subscribed"] = True
+                # messages published while unsubscribed are gone
+                local_cache.clear()
+                self.synced.set()
+                backoff = settings.LISTENER_BACKOFF_MIN
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    self.stats["fanout_received"] += 1
+                    data = json.loads(message["data"])
+                    if data.get("resync"):
+                        local_cache.clear()
+                    else:
+                        await apply_fanout(data["events"])
+            except Exception as error:
+                self.failed("Fan-out subscription failed", error)
+            finally:
+                self.stats["subscribed"] = False
+                await pubsub.aclose()
+            await asyncio.sleep(backoff * random.uniform(0.5, 1))
+            backoff = next_backoff(backoff)
+
+    async def supervise(self, name: str, run):
+        # an error the loops don't expect restarts them instead of
+        # leaving notifications queued and never applied
+        backoff = settings.LISTENER_BACKOFF_MIN
+        while True:
+            try:
+                await run()
+            except Exception as error:
+                self.failed(f"{name} failed", error)
+            self.stats["restarts"] += 1
+            await asyncio.sleep(backoff * random.uniform(0.5, 1))
+            backoff = next_backoff(backoff)
+
+    async def run(self):
+        supervised = [("Consuming notifications", self.consume)]
+        if self.leader_mode:
+            supervised.append(("Fan-out subscription", self.subscribe))
+        tasks = []
+        for name, run in supervised:
+            tasks.append(asyncio.create_task(self.supervise(name, run)))
+        try:
+            while True:
+                try:
+                    if not await self.listen():
+                        continue
+                    print("Listener connection closed")
+                except Exception as error:
+                    self.failed("Listener failed", error)
+                self.stats["reconnects"] += 1
+                # jitter keeps workers from reconnecting all at once
+                await asyncio.sleep(self.backoff * random.uniform(0.5, 1))
+                self.backoff = next_backoff(self.backoff)
+        finally:
+            for task in tasks:
+                task.cancel()
 
 
-@delete_cache
-async def listener_callback(conn, pid, channel, payload):
-    print(f"Notification received on '{channel}': {payload}")
+# asyncpg itself doesn't know the sqlalchemy dialect prefix
+listener = NotificationListener(
+    settings.get_connection().replace("postgresql+asyncpg", "postgresql"),
+    settings.LISTENER_MODE,
+)
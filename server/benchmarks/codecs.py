@@ -0,0 +1,77 @@
+import json
+import statistics
+import sys
+import time
+
+from server.benchmarks.synthetic import generate_tree
+from server.codec import TreeCodec, lz4
+from server.schema import CategoryNode, CategoryTree
+
+SIZES = (10_000, 100_000)
+REPEAT = 5
+VARIANTS = [
+    ("json", "none", 0),
+    ("json", "zlib", 1),
+    ("columnar", "none", 0),
+    ("columnar", "zlib", 1),
+    ("columnar", "zlib", 6),
+]
+if lz4 is not None:
+    VARIANTS += [("json", "lz4", 0), ("columnar", "lz4", 0)]
+
+
+def median_ms(func, *args) -> float:
+    timings = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def build(size: int):
+    return [
+        CategoryNode(category_id, name, len(path) - 1, parent_id)
+        for category_id, name, parent_id, path in generate_tree(size)
+    ]
+
+
+# what crud did before the codec: json of the rows, a CategoryTree model
+# validated for each of them on decode
+def encode_baseline(categories):
+    return json.dumps([cat._asdict() for cat in categories])
+
+
+def decode_baseline(payload):
+    return [CategoryTree(**item) for item in json.loads(payload)]
+
+
+def main(sizes):
+    print(
+        f"{'size':>8} {'codec':>18} {'bytes':>10} "
+        f"{'encode ms':>10} {'decode ms':>10}"
+    )
+    for size in sizes:
+        categories = build(size)
+        payload = encode_baseline(categories)
+        encode_ms = median_ms(encode_baseline, categories)
+        decode_ms = median_ms(decode_baseline, payload)
+        print(
+            f"{size:>8} {'baseline':>18} {len(payload):>10} "
+            f"{encode_ms:>10.2f} {decode_ms:>10.2f}"
+        )
+        for codec, compression, level in VARIANTS:
+            tree_codec = TreeCodec(codec, compression, level)
+            payload = tree_codec.encode(categories)
+            assert tree_codec.decode(payload) == categories
+            encode_ms = median_ms(tree_codec.encode, categories)
+            decode_ms = median_ms(tree_codec.decode, payload)
+            name = f"{codec}/{compression}:{level}"
+            print(
+                f"{size:>8} {name:>18} {len(payload):>10} "
+                f"{encode_ms:>10.2f} {decode_ms:>10.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or SIZES)
@@ -0,0 +1,152 @@
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from jinja2 import Environment, FileSystemBytecodeCache
+from markupsafe import Markup
+from starlette.requests import Request
+
+from server.benchmarks.codecs import build
+from server.main import app, templates
+from server.render import chunked
+from server.tree import top_levels
+
+SIZES = (1_000, 10_000, 100_000)
+REPEAT = 3
+# the tree of index.html as it was, with a loop over the levels of every
+# category instead of a precomputed indent
+LOOP_TEMPLATE = """
+{% extends "base.html" %}
+{% block content %}
+<ul class="menu">
+{% for category, collapsed in categories %}
+<li>
+    {% for i in range(category.level - base_level) %}
+        {{ indent|safe }}
+    {% endfor %}
+    <a href="/category/{{ category.id }}">{{ category.name }}</a>
+    {% if collapsed %}
+    <a href="/tree/{{ category.id }}">...</a>
+    {% endif %}
+</li>
+{% endfor %}
+</ul>
+{% endblock %}
+"""
+
+
+def fake_request() -> Request:
+    # enough of a scope for url_for in base.html
+    return Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "scheme": "http",
+            "server": ("bench", 80),
+            "path": "/",
+            "root_path": "",
+            "query_string": b"",
+            "headers": [(b"host", b"bench")],
+            "app": app,
+            "router": app.router,
+        }
+    )
+
+
+def context(categories) -> dict:
+    return {
+        "request": fake_request(),
+        "categories": top_levels(categories, 0, len(categories), 0),
+        "base_level": 0,
+        "indent": Markup("&nbsp;&nbsp;&nbsp;&nbsp;"),
+    }
+
+
+def render_loop(categories):
+    template = templates.env.from_string(LOOP_TEMPLATE)
+    yield template.render(context(categories)).encode()
+
+
+def render_string(categories):
+    body = templates.get_template("index.html").render(context(categories))
+    yield body.encode()
+
+
+def render_stream(categories):
+    pieces = templates.get_template("index.html").generate(context(categories))
+    return chunked(pieces)
+
+
+MODES = {
+    "loop": render_loop,
+    "string": render_string,
+    "stream": render_stream,
+}
+
+
+def measure(render, categories):
+    # total time, time to the first chunk and peak memory, all medians;
+    # tracemalloc slows rendering down, compare the modes with each other
+    timings, first_chunks, peaks = [], [], []
+    for _ in range(REPEAT):
+        tracemalloc.start()
+        started = time.perf_counter()
+        first = None
+        for _ in render(categories):
+            if first is None:
+                first = time.perf_counter() - started
+        timings.append(time.perf_counter() - started)
+        first_chunks.append(first)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return (
+        statistics.median(timings) * 1000,
+        statistics.median(first_chunks) * 1000,
+        statistics.median(peaks) / 1024 / 1024,
+    )
+
+
+def compile_templates(bytecode_cache) -> float:
+    # what a new worker does before its first page, in milliseconds
+    environment = Environment(
+        loader=templates.env.loader,
+        autoescape=True,
+        bytecode_cache=bytecode_cache,
+    )
+    started = time.perf_counter()
+    for name in environment.list_templates():
+        environment.get_template(name)
+    return (time.perf_counter() - started) * 1000
+
+
+def compare_compile():
+    with tempfile.TemporaryDirectory() as directory:
+        cache = FileSystemBytecodeCache(directory)
+        compiled = [compile_templates(None) for _ in range(REPEAT)]
+        # the first run fills the cache
+        compile_templates(cache)
+        loaded = [compile_templates(cache) for _ in range(REPEAT)]
+    print(
+        f"templates compiled {statistics.median(compiled):.1f} ms, "
+        f"from bytecode {statistics.median(loaded):.1f} ms"
+    )
+
+
+def main(sizes):
+    compare_compile()
+    print(
+        f"{'size':>8} {'mode':>8} {'total ms':>10} "
+        f"{'first ms':>10} {'peak MiB':>10}"
+    )
+    for size in sizes:
+        categories = build(size)
+        for mode, render in MODES.items():
+            total, first, peak = measure(render, categories)
+            row = f"{size:>8} {mode:>8} {total:>10.1f} {first:>10.1f}"
+            print(f"{row} {peak:>10.2f}")
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or SIZES)
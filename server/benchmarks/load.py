@@ -0,0 +1,212 @@
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+import asyncpg
+import httpx
+
+from server.benchmarks.synthetic import generate_categories
+
+# per scenario: latency percentiles in milliseconds (10 concurrent clients,
+# so they include waiting for the others) and requests per second, about
+# three times the results of the default run on a laptop; --budget
+# overrides any of them
+BUDGETS = {
+    "index": {"p50_ms": 100.0, "p99_ms": 300.0, "min_rps": 10.0},
+    "category": {"p50_ms": 40.0, "p99_ms": 400.0, "min_rps": 200.0},
+    "add": {"p50_ms": 100.0, "p99_ms": 500.0, "min_rps": 70.0},
+    "update": {"p50_ms": 150.0, "p99_ms": 600.0, "min_rps": 60.0},
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog="python -m server.benchmarks.load",
+        description=(
+            "Fills a scratch database with a synthetic tree, runs the app "
+            "in process against it and checks latency budgets."
+        ),
+    )
+    parser.add_argument("--size", type=int, default=10_000)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--fanout", type=int, default=10)
+    parser.add_argument("--words", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--redis-db", type=int, default=15)
+    parser.add_argument(
+        "--budget",
+        action="append",
+        default=[],
+        metavar="SCENARIO.METRIC=VALUE",
+        help="e.g. --budget index.p99_ms=800",
+    )
+    parser.add_argument(
+        "--keep",
+        action="store_true",
+        help="keep the scratch database",
+    )
+    return parser.parse_args()
+
+
+def parse_budgets(overrides):
+    budgets = {name: dict(budget) for name, budget in BUDGETS.items()}
+    for override in overrides:
+        key, value = override.split("=")
+        scenario, metric = key.split(".")
+        if metric not in budgets.get(scenario, {}):
+            sys.exit(f"Unknown budget {key}")
+        budgets[scenario][metric] = float(value)
+    return budgets
+
+
+def dsn(database: str) -> str:
+    user = os.environ["POSTGRES_USER"]
+    password = os.environ["POSTGRES_PASSWORD"]
+    host, port = os.environ["DB_HOST"], os.environ["DB_PORT"]
+    return f"postgresql://{user}:{password}@{host}:{port}/{database}"
+
+
+async def execute(database: str, query: str):
+    conn = await asyncpg.connect(dsn(database))
+    try:
+        await conn.execute(query)
+    finally:
+        await conn.close()
+
+
+def prepare_environment(args) -> str:
+    # everything runs in a database and a redis db of its own; the
+    # settings are read from the environment on the first import of the
+    # app, so this has to come before it
+    database = os.environ["POSTGRES_DB"]
+    scratch = f"{database}_load"
+    drop = f"DROP DATABASE IF EXISTS {scratch} WITH (FORCE)"
+    asyncio.run(execute(database, drop))
+    asyncio.run(execute(database, f"CREATE DATABASE {scratch}"))
+    os.environ["POSTGRES_DB"] = scratch
+    redis_url = urlsplit(os.environ["REDIS_URL"])
+    redis_url = redis_url._replace(path=f"/{args.redis_db}").geturl()
+    os.environ["REDIS_URL"] = redis_url
+    alembic = [sys.executable, "-m", "alembic", "-c", "server/alembic.ini"]
+    migration = subprocess.run(
+        [*alembic, "upgrade", "head"], capture_output=True, text=True
+    )
+    if migration.returncode:
+        sys.exit(f"Migrating {scratch} failed:\n{migration.stderr}")
+    return database
+
+
+def summarize(latencies, elapsed: float) -> dict:
+    cuts = statistics.quantiles(latencies, n=100)
+    return {
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": cuts[98] * 1000,
+        "rps": len(latencies) / elapsed,
+    }
+
+
+async def run_scenario(make_request, requests: int, concurrency: int):
+    latencies = []
+    remaining = iter(range(requests))
+
+    async def client():
+        # the clients share the counter, so all of them run until it's out
+        for _ in remaining:
+            started = time.perf_counter()
+            response = await make_request()
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                status = response.status_code
+                raise RuntimeError(f"{response.request.url}: {status}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def failures(name: str, result: dict, budget: dict):
+    for metric in ("p50_ms", "p99_ms"):
+        if result[metric] > budget[metric]:
+            yield f"{name} {metric} {result[metric]:.1f} > {budget[metric]}"
+    if result["rps"] < budget["min_rps"]:
+        yield f"{name} rps {result['rps']:.1f} < {budget['min_rps']}"
+
+
+async def run(args, budgets) -> bool:
+    from server import bulk, crud, redis_
+    from server.db import engine
+    from server.main import app
+    from server.warmup import warmup
+
+    await redis_.redis_client.flushdb()
+    rows = generate_categories(args.size, args.depth, args.fanout, args.words)
+    started = time.perf_counter()
+    await bulk.import_categories(bulk.iterate_async(rows))
+    elapsed = time.perf_counter() - started
+    print(f"Imported {args.size} categories in {elapsed:.1f}s")
+
+    async with app.router.lifespan_context(app):
+        while not warmup.ready:
+            await asyncio.sleep(0.05)
+        tree = await crud.get_tree_cached()
+        ids = [node.id for node in tree.categories]
+        rng = random.Random(0)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://load"
+        ) as client:
+            scenarios = {
+                "index": lambda: client.get("/"),
+                "category": lambda: client.get(f"/category/{rng.choice(ids)}"),
+                "add": lambda: client.post(
+                    "/add",
+                    data={"name": "added", "parent_id": rng.choice(ids)},
+                ),
+                "update": lambda: client.post(
+                    f"/category/{rng.choice(ids)}/update",
+                    data={"name": "updated", "content": "# updated\n\ntext"},
+                ),
+            }
+            print(f"{'scenario':>10} {'p50 ms':>9} {'p99 ms':>9} {'rps':>9}")
+            failed = []
+            for name, make_request in scenarios.items():
+                result = await run_scenario(
+                    make_request, args.requests, args.concurrency
+                )
+                print(
+                    f"{name:>10} {result['p50_ms']:>9.1f} "
+                    f"{result['p99_ms']:>9.1f} {result['rps']:>9.1f}"
+                )
+                failed.extend(failures(name, result, budgets[name]))
+    await redis_.redis_client.flushdb()
+    # before the loop closes, the connections can't be closed after it
+    await redis_.redis_client.aclose()
+    await engine.dispose()
+    for failure in failed:
+        print(f"Over budget: {failure}")
+    return not failed
+
+
+def main():
+    args = parse_args()
+    budgets = parse_budgets(args.budget)
+    database = prepare_environment(args)
+    try:
+        passed = asyncio.run(run(args, budgets))
+    finally:
+        if not args.keep:
+            scratch = os.environ["POSTGRES_DB"]
+            drop = f"DROP DATABASE IF EXISTS {scratch} WITH (FORCE)"
+            asyncio.run(execute(database, drop))
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import asyncio
+import statistics
+import sys
+import time
+
+from sqlalchemy import text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from server import crud
+from server.cache import TreeSnapshot
+from server.db import engine
+from server.schema import Category, CategoryNode
+
+REQUESTS = 2000
+BREADCRUMBS_QUERY = text(
+    """
+    SELECT id, name, parent_id, cardinality(path) - 1 AS level
+    FROM category
+    WHERE id = ANY(SELECT unnest(path) FROM category WHERE id = :id)
+    ORDER BY path
+    """
+)
+
+
+# what view_category did before: a session per request from get_session,
+# the category as an ORM instance and the breadcrumbs as a second query
+async def session_per_request(category_id: int, tree: TreeSnapshot):
+    async with AsyncSession(engine) as session:
+        category = await session.get(Category, category_id)
+        params = {"id": category_id}
+        result = await session.exec(BREADCRUMBS_QUERY, params=params)
+        breadcrumbs = [CategoryNode(**row) for row in result.mappings()]
+    return category, breadcrumbs
+
+
+async def session_only(category_id: int, tree: TreeSnapshot):
+    # a page cache hit used to pay for the dependency anyway
+    async with AsyncSession(engine):
+        pass
+
+
+async def core_row(category_id: int, tree: TreeSnapshot):
+    category = await crud.get_category_page(category_id)
+    return category, tree.nodes(category.path)
+
+
+async def nothing(category_id: int, tree: TreeSnapshot):
+    pass
+
+
+async def per_request_us(lookup, ids, tree, requests: int) -> float:
+    timings = []
+    for i in range(requests):
+        started = time.perf_counter()
+        await lookup(ids[i % len(ids)], tree)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1_000_000
+
+
+async def main(requests: int):
+    async with engine.connect() as conn:
+        result = await conn.execute(
+            text("SELECT id FROM category ORDER BY id LIMIT 100")
+        )
+        ids = result.scalars().all()
+    if not ids:
+        print("No categories, add some first")
+        return
+    async with AsyncSession(engine) as session:
+        categories = await crud.get_categories_tree_orm(session)
+    tree = TreeSnapshot("bench", categories)
+
+    print(f"{'path':>20} {'median us':>10}")
+    for name, lookup in (
+        ("page miss, before", session_per_request),
+        ("page miss, after", core_row),
+        ("page hit, before", session_only),
+        ("page hit, after", nothing),
+    ):
+        # the first round fills the pool and the statement caches
+        await per_request_us(lookup, ids, tree, requests)
+        median = await per_request_us(lookup, ids, tree, requests)
+        print(f"{name:>20} {median:>10.1f}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if sys.argv[1:] else REQUESTS))
@@ -0,0 +1,129 @@
+import asyncio
+import statistics
+import sys
+import time
+
+import asyncpg
+
+from server.benchmarks.synthetic import generate_articles, generate_vocabulary
+from server.search import NAME_OPTIONS, SEARCH_QUERY, SNIPPET_OPTIONS
+from server.settings import Settings
+
+settings = Settings()
+
+SIZES = (100_000, 300_000)
+REPEAT = 5
+SCHEMA = "search_bench"
+VOCABULARY = 20_000
+PAGE = 20
+
+# the query of server.search with asyncpg placeholders
+PARAMS = (
+    "query",
+    "offset",
+    "limit",
+    "max_matches",
+    "name_options",
+    "snippet_options",
+)
+RANKED = SEARCH_QUERY.text
+for number, param in enumerate(PARAMS, 1):
+    RANKED = RANKED.replace(f":{param}", f"${number}")
+# what a search without the index would do: a scan, unranked
+SCAN = """
+    SELECT id, name FROM category
+    WHERE name ILIKE '%' || $1 || '%' OR content ILIKE '%' || $1 || '%'
+    ORDER BY id
+    LIMIT $2 OFFSET $3
+"""
+
+
+def terms(vocabulary):
+    # words of every frequency, all of them and a phrase
+    common, middle, rare = vocabulary[0], vocabulary[100], vocabulary[-1]
+    return {
+        "common": (common, common),
+        "middle": (middle, middle),
+        "rare": (rare, rare),
+        "and": (f"{middle} {vocabulary[101]}", None),
+        "phrase": (f'"{vocabulary[0]} {vocabulary[1]}"', None),
+    }
+
+
+async def timed(conn: asyncpg.Connection, query: str, *args):
+    timings = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        rows = await conn.fetch(query, *args)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000, rows
+
+
+async def fill(conn: asyncpg.Connection, size: int, vocabulary):
+    await conn.execute(
+        f"""
+        DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;
+        CREATE SCHEMA {SCHEMA};
+        SET search_path TO {SCHEMA};
+        CREATE TABLE category (
+            id INTEGER PRIMARY KEY,
+            name VARCHAR(50) NOT NULL,
+            content TEXT,
+            search TSVECTOR
+        );
+        """
+    )
+    await conn.copy_records_to_table(
+        "category",
+        records=generate_articles(size, vocabulary),
+        columns=["id", "name", "content"],
+        schema_name=SCHEMA,
+    )
+    # what the on_category_search trigger computes
+    await conn.execute(
+        """
+        UPDATE category SET search =
+            setweight(to_tsvector('simple', name), 'A') ||
+            setweight(to_tsvector('simple', coalesce(content, '')), 'B');
+        CREATE INDEX ix_category_search ON category USING gin (search);
+        """
+    )
+    await conn.execute("VACUUM ANALYZE category")
+
+
+async def main(sizes):
+    dsn = settings.get_connection().replace("+asyncpg", "")
+    conn = await asyncpg.connect(dsn)
+    vocabulary = generate_vocabulary(VOCABULARY)
+    try:
+        print(
+            f"{'size':>9} {'terms':>8} {'matches':>9} "
+            f"{'ranked ms':>10} {'page 10 ms':>11} {'scan ms':>10}"
+        )
+        for size in sizes:
+            await fill(conn, size, vocabulary)
+            options = (
+                PAGE,
+                settings.SEARCH_MAX_MATCHES,
+                NAME_OPTIONS,
+                SNIPPET_OPTIONS,
+            )
+            for name, (query, word) in terms(vocabulary).items():
+                first, rows = await timed(conn, RANKED, query, 0, *options)
+                tenth, _ = await timed(conn, RANKED, query, 9 * PAGE, *options)
+                matches = rows[0]["total"] if rows else 0
+                scan = "-"
+                if word is not None:
+                    scan_ms, _ = await timed(conn, SCAN, word, PAGE, 0)
+                    scan = f"{scan_ms:.2f}"
+                print(
+                    f"{size:>9} {name:>8} {matches:>9} "
+                    f"{first:>10.2f} {tenth:>11.2f} {scan:>10}"
+                )
+    finally:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main([int(size) for size in sys.argv[1:]] or SIZES))
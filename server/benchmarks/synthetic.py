@@ -0,0 +1,93 @@
+import itertools
+import random
+from typing import Iterator, List, Optional, Tuple
+
+Row = Tuple[int, str, Optional[int], List[int]]
+
+
+def generate_tree(
+    size: int,
+    fanout: int = 10,
+    roots: int = 10,
+) -> Iterator[Row]:
+    # breadth first, so a parent always comes before its children
+    paths = {}
+    for category_id in range(1, size + 1):
+        if category_id <= roots:
+            parent_id = None
+            path = [category_id]
+        else:
+            parent_id = (category_id - roots - 1) // fanout + 1
+            path = paths[parent_id] + [category_id]
+        paths[category_id] = path
+        yield category_id, f"category {category_id}", parent_id, path
+
+
+def generate_vocabulary(size: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < size:
+        length = rng.randint(3, 10)
+        words.add("".join(rng.choice(letters) for _ in range(length)))
+    return sorted(words, key=lambda word: (len(word), word))
+
+
+def generate_articles(
+    size: int,
+    vocabulary: List[str],
+    words: int = 100,
+    seed: int = 0,
+) -> Iterator[Tuple[int, str, str]]:
+    # word frequencies follow zipf's law, like natural text: the first
+    # words of the vocabulary are in most articles, the last in a few
+    rng = random.Random(seed)
+    ranks = range(1, len(vocabulary) + 1)
+    weights = list(itertools.accumulate(1 / rank for rank in ranks))
+    for article_id in range(1, size + 1):
+        text = rng.choices(vocabulary, cum_weights=weights, k=words)
+        name = " ".join(text[:3])
+        yield article_id, name, " ".join(text)
+
+
+def markdown_article(
+    rng: random.Random,
+    vocabulary: List[str],
+    words: int,
+) -> str:
+    # a heading, paragraphs, a list and a code block, what markdown2
+    # spends its time on in real articles
+    def sentence(length: int) -> str:
+        return " ".join(rng.choices(vocabulary, k=length)).capitalize()
+
+    blocks = [f"# {sentence(4)}"]
+    for start in range(0, words, 50):
+        blocks.append(f"{sentence(min(50, words - start))}.")
+    blocks.append("\n".join(f"- {sentence(5)}" for _ in range(5)))
+    blocks.append(f"```\n{sentence(8)}\n```")
+    return "\n\n".join(blocks)
+
+
+def generate_categories(
+    size: int,
+    depth: int = 4,
+    fanout: int = 10,
+    words: int = 200,
+    seed: int = 0,
+) -> Iterator[dict]:
+    # rows for bulk.import_categories, breadth first: complete trees of
+    # the given depth and fanout, as many of them as size needs
+    per_root = sum(fanout**level for level in range(depth))
+    roots = -(-size // per_root)
+    vocabulary = generate_vocabulary(2_000, seed)
+    rng = random.Random(seed)
+    for category_id in range(1, size + 1):
+        parent_id = None
+        if category_id > roots:
+            parent_id = (category_id - roots - 1) // fanout + 1
+        yield {
+            "id": category_id,
+            "parent_id": parent_id,
+            "name": f"category {category_id}",
+            "content": markdown_article(rng, vocabulary, words),
+        }
@@ -0,0 +1,131 @@
+import asyncio
+import statistics
+import sys
+import time
+
+import asyncpg
+
+from server.benchmarks.synthetic import generate_tree
+from server.settings import Settings
+
+settings = Settings()
+
+SIZES = (10_000, 100_000, 1_000_000)
+REPEAT = 5
+SCHEMA = "category_bench"
+
+QUERIES = {
+    "tree": (
+        """
+        WITH RECURSIVE tree(id, name, parent_id, level, path) AS (
+            SELECT id, name, parent_id, 0, ARRAY[id]
+            FROM category WHERE parent_id IS NULL
+            UNION ALL
+            SELECT c.id, c.name, c.parent_id, tree.level + 1, tree.path || c.id
+            FROM category c JOIN tree ON c.parent_id = tree.id
+        )
+        SELECT id, name, parent_id, level FROM tree ORDER BY path
+        """,
+        """
+        SELECT id, name, parent_id, cardinality(path) - 1 AS level
+        FROM category ORDER BY path
+        """,
+    ),
+    "ancestors": (
+        """
+        WITH RECURSIVE up(id, name, parent_id, depth) AS (
+            SELECT id, name, parent_id, 0 FROM category WHERE id = $1
+            UNION ALL
+            SELECT c.id, c.name, c.parent_id, up.depth + 1
+            FROM category c JOIN up ON c.id = up.parent_id
+        )
+        SELECT id, name, parent_id FROM up ORDER BY depth DESC
+        """,
+        """
+        SELECT id, name, parent_id FROM category
+        WHERE id = ANY(SELECT unnest(path) FROM category WHERE id = $1)
+        ORDER BY path
+        """,
+    ),
+    "subtree": (
+        """
+        WITH RECURSIVE down(id, name, parent_id, path) AS (
+            SELECT id, name, parent_id, ARRAY[id] FROM category WHERE id = $1
+            UNION ALL
+            SELECT c.id, c.name, c.parent_id, down.path || c.id
+            FROM category c JOIN down ON c.parent_id = down.id
+        )
+        SELECT id, name, parent_id FROM down ORDER BY path
+        """,
+        """
+        SELECT c.id, c.name, c.parent_id
+        FROM category c, (SELECT path FROM category WHERE id = $1) root
+        WHERE c.path >= root.path
+          AND c.path < trim_array(root.path, 1)
+              || root.path[cardinality(root.path)] + 1
+        ORDER BY c.path
+        """,
+    ),
+}
+
+
+async def timed(conn: asyncpg.Connection, query: str, *args) -> float:
+    timings = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        await conn.fetch(query, *args)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+async def fill(conn: asyncpg.Connection, size: int):
+    await conn.execute(
+        f"""
+        DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;
+        CREATE SCHEMA {SCHEMA};
+        SET search_path TO {SCHEMA};
+        CREATE TABLE category (
+            id INTEGER PRIMARY KEY,
+            name VARCHAR(50) NOT NULL,
+            parent_id INTEGER REFERENCES category (id),
+            path INTEGER[] NOT NULL
+        );
+        """
+    )
+    await conn.copy_records_to_table(
+        "category",
+        records=generate_tree(size),
+        columns=["id", "name", "parent_id", "path"],
+        schema_name=SCHEMA,
+    )
+    await conn.execute(
+        """
+        CREATE INDEX ix_category_parent_id ON category (parent_id);
+        CREATE UNIQUE INDEX ix_category_path ON category (path)
+            INCLUDE (id, name, parent_id);
+        """
+    )
+    # sets the visibility map, so ordered reads are index only scans
+    await conn.execute("VACUUM ANALYZE category")
+
+
+async def main(sizes):
+    dsn = settings.get_connection().replace("+asyncpg", "")
+    conn = await asyncpg.connect(dsn)
+    try:
+        print(f"{'size':>9} {'query':>10} {'cte ms':>10} {'path ms':>10}")
+        for size in sizes:
+            await fill(conn, size)
+            # a deep leaf for ancestors, the second root for its subtree
+            args = {"tree": (), "ancestors": (size,), "subtree": (2,)}
+            for name, (cte, path) in QUERIES.items():
+                cte_ms = await timed(conn, cte, *args[name])
+                path_ms = await timed(conn, path, *args[name])
+                print(f"{size:>9} {name:>10} {cte_ms:>10.2f} {path_ms:>10.2f}")
+    finally:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main([int(size) for size in sys.argv[1:]] or SIZES))
@@ -0,0 +1,286 @@
+import argparse
+import asyncio
+import json
+import sys
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from server.db import engine
+from server.render import RenderQueueFull, render_pool
+
+BATCH_SIZE = 1000
+FIELDS = ("name", "content", "link")
+
+# ids are taken from the sequence up front, so children can reference
+# parents of the same batch without reading anything back
+ALLOCATE_IDS = text(
+    """
+    SELECT nextval(pg_get_serial_sequence('category', 'id'))
+    FROM generate_series(1, :count);
+"""
+)
+# parent_id must already exist when a row is inserted (the path trigger
+# reads it), so a batch goes in one statement per level
+INSERT_ROWS = text(
+    """
+    INSERT INTO category (id, parent_id, name, content, link, content_html)
+    SELECT * FROM unnest(
+        CAST(:ids AS integer[]),
+        CAST(:parent_ids AS integer[]),
+        CAST(:names AS text[]),
+        CAST(:contents AS text[]),
+        CAST(:links AS text[]),
+        CAST(:contents_html AS text[])
+    );
+"""
+)
+RELOAD = text("SELECT pg_notify('category', '{\"type\": \"reload\"}')")
+EXPORT_ROWS = text(
+    """
+    SELECT id, parent_id, name, content, link, cardinality(path) - 1 AS level
+    FROM category
+    ORDER BY path;
+"""
+)
+
+
+class BulkImportError(Exception):
+    pass
+
+
+STOP = object()
+
+
+def check_row(row, where: str) -> dict:
+    if not isinstance(row, dict) or not row.get("name"):
+        raise BulkImportError(f"{where}: expected a category with a name")
+    return row
+
+
+def load_json(content) -> Iterator[dict]:
+    # checked up front, before a connection is taken for the import
+    try:
+        nodes = json.loads(content)
+    except ValueError as error:
+        raise BulkImportError(str(error))
+    if not isinstance(nodes, list):
+        raise BulkImportError("expected a list of categories")
+    return flatten(nodes)
+
+
+def flatten(nodes: Iterable[dict]) -> Iterator[dict]:
+    # nested {"name", ..., "children": [...]} to rows with made up ids,
+    # parents first
+    counter = 0
+    stack = [(None, iter(nodes))]
+    while stack:
+        parent_id, children = stack[-1]
+        node = next(children, STOP)
+        if node is STOP:
+            stack.pop()
+            continue
+        counter += 1
+        check_row(node, f"category {counter}")
+        row = {field: node.get(field) for field in FIELDS}
+        yield {**row, "id": counter, "parent_id": parent_id}
+        stack.append((counter, iter(node.get("children") or [])))
+
+
+async def parse_ndjson(lines: AsyncIterator[str]) -> AsyncIterator[dict]:
+    number = 0
+    async for line in lines:
+        number += 1
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as error:
+            raise BulkImportError(f"line {number}: {error}")
+        yield check_row(row, f"line {number}")
+
+
+def decode_line(line: bytes, number: int) -> str:
+    try:
+        return line.decode()
+    except UnicodeDecodeError as error:
+        raise BulkImportError(f"line {number}: {error}")
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    rest = b""
+    number = 0
+    async for chunk in chunks:
+        *lines, rest = (rest + chunk).split(b"\n")
+        for line in lines:
+            number += 1
+            yield decode_line(line, number)
+    if rest:
+        yield decode_line(rest, number + 1)
+
+
+async def iterate_async(items: Iterable) -> AsyncIterator:
+    for item in items:
+        yield item
+
+
+async def insert_batch(
+    conn: AsyncConnection,
+    batch: List[dict],
+    new_ids: Dict[object, int],
+    parent_id: Optional[int],
+):
+    result = await conn.execute(ALLOCATE_IDS, {"count": len(batch)})
+    allocated = result.scalars().all()
+    # level inside this batch, parents from earlier batches are there
+    levels: Dict[object, int] = {}
+    waves: List[List[dict]] = []
+    for row, new_id in zip(batch, allocated):
+        if not row.get("name"):
+            raise BulkImportError(f"category {row.get('id')} has no name")
+        if row.get("id") in new_ids:
+            raise BulkImportError(f"category {row['id']} appears twice")
+        parent = row.get("parent_id")
+        if parent is not None and parent not in new_ids:
+            raise BulkImportError(
+                f"parent {parent} of {row.get('id')} must come before it"
+            )
+        level = levels.get(parent, -1) + 1
+        if row.get("id") is not None:
+            new_ids[row["id"]] = new_id
+            levels[row["id"]] = level
+        if level == len(waves):
+            waves.append([])
+        waves[level].append(
+            {
+                **row,
+                "id": new_id,
+                "parent_id": parent_id if parent is None else new_ids[parent],
+            }
+        )
+
+    for wave in waves:
+        contents = [row.get("content") for row in wave]
+        await conn.execute(
+            INSERT_ROWS,
+            {
+                "ids": [row["id"] for row in wave],
+                "parent_ids": [row["parent_id"] for row in wave],
+                "names": [row["name"] for row in wave],
+                "contents": contents,
+                "links": [row.get("link") for row in wave],
+                "contents_html": await render_pool.render_many(contents),
+            },
+        )
+
+
+async def import_categories(
+    rows: AsyncIterator[dict],
+    parent_id: Optional[int] = None,
+    batch_size: int = BATCH_SIZE,
+) -> int:
+    # rows are {"id", "parent_id", "name", "content", "link"}, parents
+    # before children; their ids only link them, new ones are assigned and
+    # roots go under parent_id
+    imported = 0
+    new_ids: Dict[object, int] = {}
+    try:
+        async with engine.begin() as conn:
+            # one "reload" notification at commit instead of one per row
+            await conn.execute(text("SET LOCAL category.notify = 'off'"))
+            batch = []
+            async for row in rows:
+                batch.append(row)
+                if len(batch) == batch_size:
+                    await insert_batch(conn, batch, new_ids, parent_id)
+                    imported += len(batch)
+                    batch = []
+            if batch:
+                await insert_batch(conn, batch, new_ids, parent_id)
+                imported += len(batch)
+            await conn.execute(RELOAD)
+    except DBAPIError as error:
+        # too long names, a parent_id that doesn't exist...
+        raise BulkImportError(str(error.orig.__cause__ or error.orig))
+    return imported
+
+
+async def export_rows() -> AsyncIterator[dict]:
+    async with engine.connect() as conn:
+        result = await conn.stream(EXPORT_ROWS)
+        async for row in result.mappings():
+            yield dict(row)
+
+
+async def export_ndjson() -> AsyncIterator[str]:
+    async for row in export_rows():
+        row.pop("level")
+        yield json.dumps(row) + "\n"
+
+
+async def export_json() -> AsyncIterator[str]:
+    # rows come in pre-order: a row at a lower level closes the children
+    # of the rows before it
+    depth = 0
+    first = True
+    yield "["
+    async for row in export_rows():
+        while depth > row["level"]:
+            yield "]}"
+            depth -= 1
+            first = False
+        node = json.dumps({field: row[field] for field in FIELDS})
+        yield ("" if first else ", ") + node[:-1] + ', "children": ['
+        depth += 1
+        first = True
+    yield "]}" * depth + "]\n"
+
+
+EXPORTERS = {"ndjson": export_ndjson, "json": export_json}
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "json": "application/json"}
+
+
+async def read_lines(file) -> AsyncIterator[str]:
+    for line in file:
+        yield line
+
+
+async def run_import(args):
+    if args.format == "ndjson":
+        rows = parse_ndjson(read_lines(args.file))
+    else:
+        rows = iterate_async(load_json(args.file.read()))
+    imported = await import_categories(rows, args.parent_id)
+    print(f"Imported {imported} categories", file=sys.stderr)
+
+
+async def run_export(args):
+    async for chunk in EXPORTERS[args.format]():
+        args.file.write(chunk)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m server.bulk")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import")
+    import_parser.add_argument("file", type=argparse.FileType("r"))
+    import_parser.add_argument("--parent-id", type=int)
+    export_parser = commands.add_parser("export")
+    export_parser.add_argument(
+        "file", type=argparse.FileType("w"), nargs="?", default=sys.stdout
+    )
+    for command in (import_parser, export_parser):
+        command.add_argument("--format", choices=EXPORTERS, default="ndjson")
+
+    args = parser.parse_args()
+    run = run_import if args.command == "import" else run_export
+    try:
+        asyncio.run(run(args))
+    except (BulkImportError, RenderQueueFull) as error:
+        sys.exit(f"Import failed, nothing was written: {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import asyncio
+import functools
+import hashlib
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Union
+
+from server.schema import CategoryEntry, CategoryNode
+from server.settings import Settings
+
+settings = Settings()
+
+
+class TreeSnapshot:
+    def __init__(self, version: str, categories: List[CategoryNode]):
+        self.version = version
+        self.categories = categories
+        self.positions = {node.id: i for i, node in enumerate(categories)}
+
+    def nodes(self, ids: List[int]) -> Optional[List[CategoryNode]]:
+        # None when any of them isn't in the tree yet
+        positions = [self.positions.get(node_id) for node_id in ids]
+        if None in positions:
+            return None
+        return [self.categories[position] for position in positions]
+
+
+class RenderedPage(NamedTuple):
+    etag: str
+    body: bytes
+    base_url: str
+    # breadcrumbs come from the tree, so the page is only valid with it
+    tree_version: str
+
+    def size(self) -> int:
+        return len(self.body)
+
+
+class SizedLRU:
+    # least recently used first, capped by the size() of what it holds;
+    # anything over item_max_bytes isn't kept, so one huge article can't
+    # push everything else out
+    def __init__(self, max_bytes: int, item_max_bytes: int):
+        self.items: OrderedDict = OrderedDict()
+        self.bytes = 0
+        self.max_bytes = max_bytes
+        self.item_max_bytes = item_max_bytes
+
+    def __contains__(self, key: int) -> bool:
+        return key in self.items
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def get(self, key: int):
+        item = self.items.get(key)
+        if item is not None:
+            self.items.move_to_end(key)
+        return item
+
+    def set(self, key: int, item):
+        size = item.size()
+        if size > self.item_max_bytes:
+            return
+        self.pop(key)
+        self.items[key] = item
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, evicted = self.items.popitem(last=False)
+            self.bytes -= evicted.size()
+
+    def pop(self, key: int):
+        item = self.items.pop(key, None)
+        if item is not None:
+            self.bytes -= item.size()
+
+    def clear(self):
+        self.items.clear()
+        self.bytes = 0
+
+
+def content_version(*parts: Union[str, bytes]) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part.encode() if isinstance(part, str) else part)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class LocalCache:
+    def __init__(
+        self,
+        entries_max_bytes: int,
+        entry_max_bytes: int,
+        pages_max_bytes: int,
+    ):
+        self.tree: Optional[TreeSnapshot] = None
+        # bumped on every invalidation, so a request that started reading
+        # before it can't put stale data back
+        self.generation = 0
+        # the tree before the last invalidation and the load replacing it
+        self.stale: Optional[TreeSnapshot] = None
+        self.loading: Optional[asyncio.Task] = None
+        # rendered pages by the size of their html, entries by their texts
+        self.pages = SizedLRU(pages_max_bytes, entry_max_bytes)
+        self.entries = SizedLRU(entries_max_bytes, entry_max_bytes)
+        self.stats: Dict[str, Dict[str, int]] = {
+            "local": {"hits": 0, "misses": 0},
+            "redis": {"hits": 0, "misses": 0},
+            "pages": {"hits": 0, "misses": 0},
+            "entries": {"hits": 0, "misses": 0},
+            "entries_redis": {"hits": 0, "misses": 0},
+            "search": {"hits": 0, "misses": 0},
+        }
+
+    def record(self, tier: str, hit: bool):
+        self.stats[tier]["hits" if hit else "misses"] += 1
+
+    def get_tree(self) -> Optional[TreeSnapshot]:
+        self.record("local", self.tree is not None)
+        return self.tree
+
+    def set_tree(self, tree: TreeSnapshot, generation: int):
+        if generation != self.generation:
+            return
+        self.tree = tree
+        # pages rendered with an older tree are never served again
+        for category_id in list(self.pages):
+            if self.pages.items[category_id].tree_version != tree.version:
+                self.pages.pop(category_id)
+
+    def loading_done(self, task: asyncio.Task):
+        if self.loading is task:
+            self.loading = None
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Loading the category tree failed: {task.exception()!r}")
+
+    def get_page(self, category_id: int, base_url: str):
+        page = self.pages.get(category_id)
+        if self.tree is None:
+            page = None
+        elif page is not None and page.tree_version != self.tree.version:
+            self.pages.pop(category_id)
+            page = None
+        if page is not None and page.base_url != base_url:
+            page = None
+        self.record("pages", page is not None)
+        return page
+
+    def set_page(self, category_id: int, page: RenderedPage, generation: int):
+        if generation == self.generation:
+            self.pages.set(category_id, page)
+
+    def evict_page(self, category_id: int):
+        self.pages.pop(category_id)
+
+    def get_entry(self, category_id: int) -> Optional[CategoryEntry]:
+        entry = self.entries.get(category_id)
+        self.record("entries", entry is not None)
+        return entry
+
+    def set_entry(self, entry: CategoryEntry, generation: int):
+        if generation == self.generation:
+            self.entries.set(entry.id, entry)
+
+    def evict_entry(self, category_id: int):
+        self.entries.pop(category_id)
+
+    def clear_entries(self):
+        self.entries.clear()
+
+    def invalidate(self):
+        self.stale = self.tree or self.stale
+        self.tree = None
+        self.loading = None
+        self.generation += 1
+
+    def clear(self):
+        self.invalidate()
+        self.stale = None
+        self.pages.clear()
+        self.clear_entries()
+
+
+local_cache = LocalCache(
+    settings.CATEGORY_CACHE_BYTES,
+    settings.CATEGORY_CACHE_ENTRY_BYTES,
+    settings.CATEGORY_PAGE_CACHE_BYTES,
+)
+
+
+def invalidate_local_cache(func_):
+    @functools.wraps(func_)
+    async def wrapper(*args, **kwargs):
+        result = await func_(*args, **kwargs)
+        local_cache.invalidate()
+        return result
+
+    return wrapper
@@ -0,0 +1,126 @@
+import json
+import struct
+import sys
+import zlib
+from array import array
+from typing import List
+
+from server.schema import CategoryNode
+from server.settings import Settings
+
+try:
+    import lz4.frame
+except ImportError:  # optional, only needed for CACHE_COMPRESSION=lz4
+    lz4 = None
+
+settings = Settings()
+
+# payload: one byte codec, one byte compression, then the (compressed) body;
+# the cache is written by this code only, so rows aren't validated again
+# and are decoded straight into tuples
+CODECS = {"json": 1, "columnar": 2}
+COMPRESSIONS = {"none": 0, "zlib": 1, "lz4": 2}
+# ids, parent ids (0 for roots) and levels, then names separated by NUL,
+# which postgres text can't contain
+COLUMNAR_HEADER = struct.Struct("<I")
+
+
+def encode_json(categories: List[CategoryNode]) -> bytes:
+    return json.dumps([cat._asdict() for cat in categories]).encode()
+
+
+def decode_json(body: bytes) -> List[CategoryNode]:
+    return [CategoryNode(**item) for item in json.loads(body)]
+
+
+def little_endian(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def from_little_endian(typecode: str, body: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(body)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def encode_columnar(categories: List[CategoryNode]) -> bytes:
+    ids = array("i", (cat.id for cat in categories))
+    parent_ids = array("i", (cat.parent_id or 0 for cat in categories))
+    levels = array("H", (cat.level for cat in categories))
+    names = "\0".join(cat.name for cat in categories).encode()
+    return b"".join(
+        (
+            COLUMNAR_HEADER.pack(len(categories)),
+            little_endian(ids),
+            little_endian(parent_ids),
+            little_endian(levels),
+            names,
+        )
+    )
+
+
+def decode_columnar(body: bytes) -> List[CategoryNode]:
+    (count,) = COLUMNAR_HEADER.unpack_from(body)
+    start = COLUMNAR_HEADER.size
+    columns = []
+    for typecode, width in (("i", 4), ("i", 4), ("H", 2)):
+        end = start + count * width
+        columns.append(from_little_endian(typecode, body[start:end]))
+        start = end
+    ids, parent_ids, levels = columns
+    names = body[start:].decode().split("\0") if count else []
+    parent_ids = [parent_id or None for parent_id in parent_ids]
+    return list(map(CategoryNode, ids, names, levels, parent_ids))
+
+
+ENCODERS = {1: encode_json, 2: encode_columnar}
+DECODERS = {1: decode_json, 2: decode_columnar}
+
+
+def compress(compression: int, body: bytes, level: int) -> bytes:
+    if compression == COMPRESSIONS["zlib"]:
+        return zlib.compress(body, level)
+    if compression == COMPRESSIONS["lz4"]:
+        return lz4.frame.compress(body, compression_level=level)
+    return body
+
+
+def decompress(compression: int, body: bytes) -> bytes:
+    if compression == COMPRESSIONS["zlib"]:
+        return zlib.decompress(body)
+    if compression == COMPRESSIONS["lz4"]:
+        return lz4.frame.decompress(body)
+    return body
+
+
+class TreeCodec:
+    def __init__(self, codec: str, compression: str, level: int):
+        if compression == "lz4" and lz4 is None:
+            raise RuntimeError("CACHE_COMPRESSION=lz4 needs the lz4 package")
+        self.codec = CODECS[codec]
+        self.compression = COMPRESSIONS[compression]
+        self.level = level
+
+    def encode(self, categories: List[CategoryNode]) -> bytes:
+        body = ENCODERS[self.codec](categories)
+        body = compress(self.compression, body, self.level)
+        return bytes((self.codec, self.compression)) + body
+
+    def decode(self, payload: bytes) -> List[CategoryNode]:
+        if payload[:1] == b"[":
+            # plain json written before the codec existed
+            return decode_json(payload)
+        codec, compression = payload[0], payload[1]
+        return DECODERS[codec](decompress(compression, payload[2:]))
+
+
+tree_codec = TreeCodec(
+    settings.CACHE_CODEC,
+    settings.CACHE_COMPRESSION,
+    settings.CACHE_COMPRESSION_LEVEL,
+)
@@ -1,35 +1,140 @@
-import functools
+import asyncio
 import json
-from typing import List
+import time
+from typing import Dict, List, Optional
 
-from sqlalchemy import text
+from redis.exceptions import LockError, WatchError
+from sqlalchemy import bindparam, select, text
+from sqlalchemy.engine import Row
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from server import redis_
-from server.schema import Category, CategoryCreate, CategoryTree
+from server.cache import TreeSnapshot, content_version, local_cache
+from server.codec import tree_codec
+from server.db import engine
+from server.metrics import registry
+from server.render import render_pool
+from server.schema import Category, CategoryCreate, CategoryEntry, CategoryNode
+from server.settings import Settings
+from server.timing import timed
+from server.tree import apply_row
 
+settings = Settings()
 
-def delete_cache(func_):
-    @functools.wraps(func_)
-    async def wrapper(*args, **kwargs):
-        result = await func_(*args, **kwargs)
-        await redis_.redis_client.delete("categories")
-        return result
+# every worker applies each notification, so updates of the cached tree
+# race; a lost race is retried on the fresh value before giving up
+CACHE_UPDATE_RETRIES = 3
+TREE_REBUILD_POLL_INTERVAL = 0.05
+# stores a category entry only if its version is still the one read
+# before the row was: an eviction in between (by this worker or any
+# other) bumped it, and the row may be older than the edit
+CACHE_ENTRY_SCRIPT = """
+if (redis.call('GET', KEYS[1]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
 
-    return wrapper
 
+# the page of a category needs these columns only, fetched as a plain row
+# instead of an ORM instance
+CATEGORY_PAGE_QUERY = select(
+    Category.id,
+    Category.name,
+    Category.parent_id,
+    Category.link,
+    Category.content,
+    Category.content_html,
+    Category.path,
+).where(Category.id == bindparam("id"))
 
-async def get_breadcrumbs(tree, category_id: int) -> List[Category]:
-    by_id = {node.id: node for node in tree}
 
-    breadcrumbs = []
-    current = by_id.get(category_id)
+async def get_category_page(category_id: int) -> Optional[Row]:
+    with timed("db"):
+        async with engine.connect() as conn:
+            params = {"id": category_id}
+            result = await conn.execute(CATEGORY_PAGE_QUERY, params)
+            return result.first()
 
-    while current:
-        breadcrumbs.append(current)
-        current = by_id.get(current.parent_id)
 
-    return list(reversed(breadcrumbs))
+def entry_key(category_id: int) -> str:
+    return f"category:{category_id}"
+
+
+def version_key(category_id: int) -> str:
+    return f"category:{category_id}:v"
+
+
+def make_entry(row: Row) -> CategoryEntry:
+    content, content_html = row.content, row.content_html
+    if not content:
+        content, content_html = None, None
+    elif content_html is not None:
+        content = None
+    return CategoryEntry(
+        id=row.id,
+        name=row.name,
+        parent_id=row.parent_id,
+        link=row.link,
+        path=row.path,
+        content=content,
+        content_html=content_html,
+    )
+
+
+async def get_category_entry(category_id: int) -> Optional[CategoryEntry]:
+    entry = local_cache.get_entry(category_id)
+    if entry is not None:
+        return entry
+
+    generation = local_cache.generation
+    key, version_at = entry_key(category_id), version_key(category_id)
+    with timed("redis"):
+        command = redis_.redis_client.mget(key, version_at)
+        read = await redis_.degraded(command)
+    cached, version = read or (None, None)
+    local_cache.record("entries_redis", cached is not None)
+    if cached:
+        with timed("decode"):
+            entry = CategoryEntry(**json.loads(cached))
+    else:
+        row = await get_category_page(category_id)
+        if row is None:
+            return None
+        entry = make_entry(row)
+        small = entry.size() <= settings.CATEGORY_CACHE_ENTRY_BYTES
+        # without the version there's no telling whether the row is current
+        if read is not None and small:
+            with timed("redis"):
+                command = redis_.redis_client.eval(
+                    CACHE_ENTRY_SCRIPT,
+                    2,
+                    version_at,
+                    key,
+                    (version or b"0").decode(),
+                    json.dumps(entry._asdict()),
+                    settings.CATEGORY_CACHE_TTL,
+                )
+                await redis_.degraded(command)
+    local_cache.set_entry(entry, generation)
+    return entry
+
+
+async def get_breadcrumbs(category_id: int) -> List[CategoryNode]:
+    # every id on the path is a primary key lookup
+    raw_sql = text(
+        """
+        SELECT id, name, parent_id, cardinality(path) - 1 AS level
+        FROM category
+        WHERE id = ANY(SELECT unnest(path) FROM category WHERE id = :id)
+        ORDER BY path;
+    """
+    )
+    with timed("db"):
+        async with engine.connect() as conn:
+            result = await conn.execute(raw_sql, {"id": category_id})
+            return [CategoryNode(**row) for row in result.mappings().all()]
 
 
 async def create_category(
@@ -37,38 +142,22 @@ async def create_category(
     category: CategoryCreate,
 ):
     category = Category.model_validate(category)
-    session.add(category)
-    await session.commit()
-    await session.refresh(category)
+    with timed("markdown"):
+        category.content_html = await render_pool.render(category.content)
+    with timed("db"):
+        session.add(category)
+        await session.commit()
+        await session.refresh(category)
     return category
 
 
-async def get_categories_tree_orm(session: AsyncSession) -> List[CategoryTree]:
+async def get_categories_tree_orm(session: AsyncSession) -> List[CategoryNode]:
+    # path holds the ids from the root, so ordering by it walks the tree the
+    # same way the recursive CTE used to, straight off the path index
     raw_sql = text(
         """
-        WITH RECURSIVE "CategoryTree"(id, name, parent_id, level, path) AS (
-            SELECT
-                id,
-                name,
-                parent_id,
-                0 AS level,
-                ARRAY[id] AS path
-            FROM category
-            WHERE parent_id IS NULL
-
-            UNION ALL
-
-            SELECT
-                c.id,
-                c.name,
-                c.parent_id,
-                ct.level + 1,
-                ct.path || c.id
-            FROM category c
-            JOIN "CategoryTree" ct ON c.parent_id = ct.id
-        )
-        SELECT id, name, parent_id, level
-        FROM "CategoryTree"
+        SELECT id, name, parent_id, cardinality(path) - 1 AS level
+        FROM category
         ORDER BY path;
     """
     )
@@ -76,33 +165,187 @@ async def get_categories_tree_orm(session: AsyncSession) -> List[CategoryTree]:
     result = await session.exec(raw_sql)
     rows = result.mappings().all()
 
-    return [CategoryTree(**row) for row in rows]
+    return [CategoryNode(**row) for row in rows]
 
 
-async def get_categories_cached(session: AsyncSession) -> List[CategoryTree]:
-    cached = await redis_.redis_client.get("categories")
-    if cached:
-        raw_categories = json.loads(cached)
-        categories = [CategoryTree(**item) for item in raw_categories]
-    else:
-        categories = await get_categories_tree_orm(session)
-        categories_json = json.dumps([cat.model_dump() for cat in categories])
-        await redis_.redis_client.set("categories", categories_json)
-    return categories
+def load_categories(cached: bytes) -> List[CategoryNode]:
+    return tree_codec.decode(cached)
+
+
+def dump_categories(categories: List[CategoryNode]) -> bytes:
+    return tree_codec.encode(categories)
+
+
+async def query_tree() -> bytes:
+    registry.inc("tree_rebuilds_total")
+    with timed("db"):
+        async with AsyncSession(engine) as session:
+            categories = await get_categories_tree_orm(session)
+    with timed("encode"):
+        return dump_categories(categories)
+
+
+async def rebuild_categories() -> bytes:
+    lock = redis_.redis_client.lock(
+        "categories:lock",
+        timeout=settings.TREE_REBUILD_LOCK_TIMEOUT,
+        blocking=False,
+    )
+    acquired = await redis_.degraded(lock.acquire())
+    if acquired is None:
+        # without redis there's nobody to wait for or to share it with
+        return await query_tree()
+    if not acquired:
+        # another worker runs the CTE, wait for its result
+        deadline = time.monotonic() + settings.TREE_REBUILD_LOCK_TIMEOUT
+        while time.monotonic() < deadline and not redis_.breaker.open:
+            await asyncio.sleep(TREE_REBUILD_POLL_INTERVAL)
+            with timed("redis"):
+                command = redis_.redis_client.get("categories")
+                cached = await redis_.degraded(command)
+            if cached:
+                return cached
+        lock = None
+
+    try:
+        cached = await query_tree()
+        with timed("redis"):
+            command = redis_.redis_client.set("categories", cached)
+            await redis_.degraded(command)
+        return cached
+    finally:
+        if lock is not None:
+            try:
+                await lock.release()
+            except (LockError, *redis_.UNAVAILABLE):
+                pass
+
+
+async def load_tree() -> TreeSnapshot:
+    generation = local_cache.generation
+    with timed("redis"):
+        command = redis_.redis_client.get("categories")
+        cached = await redis_.degraded(command)
+    local_cache.record("redis", bool(cached))
+    if not cached:
+        cached = await rebuild_categories()
+    with timed("decode"):
+        categories = load_categories(cached)
+        tree = TreeSnapshot(content_version(cached), categories)
+    local_cache.set_tree(tree, generation)
+    return tree
+
+
+async def get_tree_cached() -> TreeSnapshot:
+    tree = local_cache.get_tree()
+    if tree is not None:
+        return tree
+
+    # concurrent misses share one load
+    loading = local_cache.loading
+    if loading is None:
+        loading = local_cache.loading = asyncio.create_task(load_tree())
+        loading.add_done_callback(local_cache.loading_done)
+    if settings.SERVE_STALE_TREE and local_cache.stale is not None:
+        return local_cache.stale
+    return await asyncio.shield(loading)
+
+
+async def get_category_rows(category_ids: List[int]) -> Dict[int, dict]:
+    raw_sql = text(
+        """
+        SELECT id, name, parent_id FROM category WHERE id = ANY(:ids);
+    """
+    )
+    async with engine.connect() as conn:
+        result = await conn.execute(raw_sql, {"ids": category_ids})
+        return {row["id"]: dict(row) for row in result.mappings()}
+
+
+async def apply_category_events(events: List[dict]):
+    # events are deduplicated by id and in the order they were notified,
+    # so parents are spliced in before their children
+    if len(events) <= settings.LISTENER_REBUILD_THRESHOLD:
+        try:
+            if await update_cached_tree(events):
+                return
+        except redis_.UNAVAILABLE:
+            pass
+    await redis_.pending.delete("categories")
+
+
+async def update_cached_tree(events: List[dict]) -> bool:
+    # False when it lost every race and the cached tree has to go
+    existing = [event["id"] for event in events if event["type"] != "delete"]
+    for _ in range(CACHE_UPDATE_RETRIES):
+        async with redis_.redis_client.pipeline() as pipe:
+            try:
+                await pipe.watch("categories")
+                cached = await pipe.get("categories")
+                if not cached:
+                    return True
+                rows = await get_category_rows(existing)
+                loaded = categories = load_categories(cached)
+                for event in events:
+                    row = rows.get(event["id"])
+                    categories = apply_row(categories, event["id"], row)
+                    if categories is None:
+                        break
+                if categories == loaded:
+                    # another worker has spliced it in already, writing it
+                    # again would only fail their watch
+                    await pipe.unwatch()
+                    return True
+                pipe.multi()
+                if categories is None:
+                    print("Cached tree disagrees with the database, dropping")
+                    pipe.delete("categories")
+                else:
+                    pipe.set("categories", dump_categories(categories))
+                await pipe.execute()
+                return True
+            except WatchError:
+                continue
+    return False
+
+
+async def evict_category_entries(category_ids: List[int]):
+    # redis only, every worker evicts its own local entries
+    if category_ids:
+        await redis_.pending.delete_and_bump(
+            list(map(entry_key, category_ids)),
+            list(map(version_key, category_ids)),
+            settings.CATEGORY_CACHE_TTL,
+        )
+
+
+async def resync_cache():
+    # notifications may have been missed, nothing cached can be trusted
+    local_cache.clear()
+    await redis_.pending.delete("categories")
+    await redis_.pending.delete_matching("category:*")
 
 
 async def update_category(
     session: AsyncSession,
     category_id: int,
     name: str,
+    content: Optional[str] = None,
 ):
-    category = await session.get(Category, category_id)
+    with timed("db"):
+        category = await session.get(Category, category_id)
     category.name = name
-    await session.commit()
+    if content is not None:
+        category.content = content
+        with timed("markdown"):
+            category.content_html = await render_pool.render(content)
+    with timed("db"):
+        await session.commit()
     return category
 
 
 async def delete_category(session: AsyncSession, category_id: int):
-    category = await session.get(Category, category_id)
-    await session.delete(category)
-    await session.commit()
+    with timed("db"):
+        category = await session.get(Category, category_id)
+        await session.delete(category)
+        await session.commit()
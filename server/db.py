@@ -1,7 +1,95 @@
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError
 from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from server.settings import Settings
 
 settings = Settings()
 
-engine = create_async_engine(settings.get_connection(), echo=True)
+
+class PoolMetrics:
+    def __init__(self):
+        self.checkouts = 0
+        self.overflow_checkouts = 0
+        self.timeouts = 0
+        # checkouts that failed opening a new connection
+        self.connect_errors = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        # connection record id -> when its connection was opened
+        self.connected_at = {}
+
+    def record_wait(self, seconds: float, overflow: int):
+        self.checkouts += 1
+        self.wait_seconds_total += seconds
+        self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+        if overflow > 0:
+            self.overflow_checkouts += 1
+
+    def snapshot(self, pool) -> dict:
+        now = time.monotonic()
+        ages = [now - opened for opened in self.connected_at.values()]
+        checkouts = max(self.checkouts, 1)
+        return {
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "checkouts": self.checkouts,
+            "overflow_checkouts": self.overflow_checkouts,
+            "timeouts": self.timeouts,
+            "connect_errors": self.connect_errors,
+            "wait_seconds_total": self.wait_seconds_total,
+            "wait_seconds_max": self.wait_seconds_max,
+            "wait_seconds_mean": self.wait_seconds_total / checkouts,
+            "connections": len(ages),
+            "connection_age_seconds_max": max(ages, default=0.0),
+            "connection_age_seconds_mean": sum(ages) / max(len(ages), 1),
+        }
+
+
+pool_metrics = PoolMetrics()
+
+
+class MeteredPool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except TimeoutError:
+            pool_metrics.timeouts += 1
+            raise
+        except Exception:
+            pool_metrics.connect_errors += 1
+            raise
+        waited = time.perf_counter() - started
+        pool_metrics.record_wait(waited, self.overflow())
+        return connection
+
+
+engine = create_async_engine(
+    settings.get_connection(),
+    echo=settings.DB_ECHO,
+    poolclass=MeteredPool,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+    connect_args={
+        "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+        "command_timeout": settings.DB_COMMAND_TIMEOUT,
+    },
+)
+
+
+@event.listens_for(engine.sync_engine.pool, "connect")
+def on_connect(dbapi_connection, connection_record):
+    pool_metrics.connected_at[id(connection_record)] = time.monotonic()
+
+
+@event.listens_for(engine.sync_engine.pool, "close")
+def on_close(dbapi_connection, connection_record):
+    pool_metrics.connected_at.pop(id(connection_record), None)
@@ -1,22 +1,33 @@
 import asyncio
+import os
+import tempfile
 from contextlib import asynccontextmanager
-from typing import Optional
+from typing import List, Optional
 
-import markdown2
-from fastapi import Depends, FastAPI, Form, Request
-from fastapi.responses import RedirectResponse
+from fastapi import Depends, FastAPI, Form, HTTPException, Query, Request
+from fastapi.responses import (
+    JSONResponse,
+    PlainTextResponse,
+    RedirectResponse,
+    Response,
+    StreamingResponse,
+)
 from fastapi.templating import Jinja2Templates
-from markupsafe import Markup
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 from sqlmodel.ext.asyncio.session import AsyncSession
 from starlette.responses import HTMLResponse
 from starlette.staticfiles import StaticFiles
 
-from server import crud
-from server.background import listen_notifications
-from server.crud import get_categories_cached
-from server.db import engine
-from server.schema import Category, CategoryCreate
+from server import bulk, crud, metrics, redis_, search, timing
+from server.assets import AssetFiles, Assets, build_assets
+from server.background import listener
+from server.cache import RenderedPage, content_version, local_cache
+from server.db import engine, pool_metrics
+from server.render import Indents, RenderQueueFull, chunked, render_pool
+from server.schema import CategoryCreate, CategoryEntry, CategoryNode
 from server.settings import Settings
+from server.tree import descendants, subtree_end, top_levels
+from server.warmup import warmup
 
 settings = Settings()
 
@@ -28,19 +39,109 @@ async def get_session() -> AsyncSession:
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
-    task_update = asyncio.create_task(listen_notifications())
+    warm_templates()
+    tasks = [
+        asyncio.create_task(listener.run()),
+        asyncio.create_task(warmup.run()),
+        asyncio.create_task(warmup.flush_periodically()),
+    ]
+    if settings.METRICS:
+        tasks.append(asyncio.create_task(metrics.registry.push_periodically()))
     yield
-    task_update.cancel()
+    for task in tasks:
+        task.cancel()
+    if redis_.breaker.recovering is not None:
+        redis_.breaker.recovering.cancel()
+    try:
+        await warmup.flush_views()
+    except Exception as error:
+        print(f"Flushing category views failed: {error!r}")
+    render_pool.shutdown()
 
 
 app = FastAPI(lifespan=lifespan)
+# the profiler wraps the timing, so profiled requests are timed too
+app.add_middleware(timing.TimingMiddleware)
+app.add_middleware(timing.ProfilerMiddleware)
+
+
+@app.exception_handler(RenderQueueFull)
+async def render_queue_full(request: Request, error: RenderQueueFull):
+    # page views and writes alike, markdown waits for a render process
+    return JSONResponse(
+        {"detail": str(error)},
+        status_code=503,
+        headers={"Retry-After": "1"},
+    )
+
 
-app.mount(
-    "/static",
-    StaticFiles(directory=settings.STATIC_DIRECTORY),
-    name="static",
+bytecode_cache = None
+if settings.TEMPLATE_BYTECODE_CACHE:
+    directory = settings.TEMPLATE_CACHE_DIRECTORY
+    bytecode_cache = FileSystemBytecodeCache(directory)
+environment = Environment(
+    loader=FileSystemLoader("server/templates"),
+    autoescape=True,
+    bytecode_cache=bytecode_cache,
+    auto_reload=settings.TEMPLATE_AUTO_RELOAD,
 )
-templates = Jinja2Templates(directory="server/templates")
+environment.globals["indents"] = Indents()
+if settings.STATIC_FINGERPRINT:
+    build_directory = settings.STATIC_BUILD_DIRECTORY or os.path.join(
+        tempfile.gettempdir(), "static-assets"
+    )
+    manifest = build_assets(settings.STATIC_DIRECTORY, build_directory)
+    assets = Assets(build_directory, manifest)
+    static_files = AssetFiles(assets, directory=settings.STATIC_DIRECTORY)
+    environment.globals["url_for"] = assets.url_for
+    static_version = assets.version
+else:
+    static_files = StaticFiles(directory=settings.STATIC_DIRECTORY)
+    static_version = ""
+app.mount("/static", static_files, name="static")
+templates = Jinja2Templates(env=environment)
+
+
+def warm_templates():
+    # compiles (or loads from the bytecode cache) every template before the
+    # first request instead of during it
+    for name in templates.env.list_templates():
+        templates.get_template(name)
+
+
+def template_version() -> str:
+    # a deploy that only changes the markup mustn't be answered with 304
+    sources = []
+    for name in environment.list_templates():
+        sources.append(environment.loader.get_source(environment, name)[0])
+    return content_version(*sources)
+
+
+# what every page depends on besides its data, read once on startup
+page_version = content_version(static_version, template_version())
+
+
+def make_etag(request: Request, *parts: str) -> str:
+    base_url = str(request.base_url)
+    return f'"{content_version(base_url, page_version, *parts)}"'
+
+
+def cache_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": settings.PAGE_CACHE_CONTROL}
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    return etag in tags
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag))
 
 
 @app.get("/health")
@@ -48,6 +149,83 @@ def health():
     return {"status": "ok"}
 
 
+@app.get("/ready")
+def ready():
+    # for the load balancer: 503 until the caches of this worker are warm
+    status_code = 200 if warmup.ready else 503
+    return JSONResponse(warmup.stats, status_code=status_code)
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    return local_cache.stats
+
+
+@app.get("/db/stats")
+def db_stats():
+    return pool_metrics.snapshot(engine.sync_engine.pool)
+
+
+@app.get("/redis/stats")
+def redis_stats():
+    return redis_.snapshot()
+
+
+@app.get("/listener/stats")
+def listener_stats():
+    return listener.snapshot()
+
+
+def collect_stats(snapshot: metrics.Snapshot):
+    # what the caches, the pool and the listener count already
+    for tier, counts in local_cache.stats.items():
+        labels = {"tier": tier}
+        snapshot.counter("cache_hits_total", counts["hits"], labels)
+        snapshot.counter("cache_misses_total", counts["misses"], labels)
+    pool = pool_metrics.snapshot(engine.sync_engine.pool)
+    snapshot.counter("db_pool_checkouts_total", pool["checkouts"])
+    snapshot.counter("db_pool_timeouts_total", pool["timeouts"])
+    errors = pool["connect_errors"]
+    snapshot.counter("db_pool_connect_errors_total", errors)
+    wait = pool["wait_seconds_total"]
+    snapshot.counter("db_pool_wait_seconds_total", wait)
+    snapshot.gauge("db_pool_checked_out", pool["checked_out"])
+    snapshot.gauge("render_pending", render_pool.pending)
+    stats = redis_.snapshot()
+    snapshot.gauge("redis_circuit_open", stats["open"])
+    for name in ("opened", "rejected", "failures"):
+        snapshot.counter(f"redis_{name}_total", stats[name])
+    pending = stats["pending_invalidations"]
+    snapshot.gauge("redis_pending_invalidations", pending)
+    snapshot.gauge("redis_connections", stats["connections"])
+    stats = listener.snapshot()
+    for name in ("received", "batches", "failed_batches", "reconnects"):
+        snapshot.counter(f"listener_{name}_total", stats[name])
+    snapshot.counter("listener_resyncs_total", stats["resyncs"])
+    snapshot.gauge("listener_lag_seconds", stats["lag_seconds_last"])
+    snapshot.gauge("listener_lag_seconds_max", stats["lag_seconds_max"])
+    snapshot.gauge("listener_queue_depth", stats["queue_depth"])
+    snapshot.gauge("listener_connected", stats["connected"])
+    snapshot.gauge("listener_leader", stats["leader"])
+
+
+metrics.registry.collectors.append(collect_stats)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    # all workers, whichever of them answers
+    snapshot = await metrics.collect_workers()
+    hits = snapshot.counters.get("cache_hits_total", {})
+    misses = snapshot.counters.get("cache_misses_total", {})
+    ratios = snapshot.gauges.setdefault("cache_hit_ratio", {})
+    for key, hit in hits.items():
+        lookups = hit + misses.get(key, 0.0)
+        ratios[key] = hit / lookups if lookups else 0.0
+    body = snapshot.render()
+    return PlainTextResponse(body, media_type=metrics.CONTENT_TYPE)
+
+
 @app.post("/add")
 async def add_category(
     name: str = Form(...),
@@ -61,55 +239,208 @@ async def add_category(
     return RedirectResponse("/", status_code=303)
 
 
+def get_position(tree, category_id: int) -> int:
+    position = tree.positions.get(category_id)
+    if position is None:
+        raise HTTPException(status_code=404)
+    return position
+
+
+def tree_response(request: Request, tree, start: int, end: int):
+    max_level = settings.INDEX_MAX_LEVEL
+    etag = make_etag(request, tree.version, str(start), str(max_level))
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    base_level = tree.categories[start].level if start < end else 0
+    context = {
+        "request": request,
+        "categories": top_levels(tree.categories, start, end, max_level),
+        "base_level": base_level,
+    }
+    if end - start > settings.INDEX_STREAM_THRESHOLD:
+        # the snapshot is never modified, so the page is rendered lazily
+        # from it while it's sent, in starlette's threadpool
+        pieces = templates.get_template("index.html").generate(context)
+        return StreamingResponse(
+            timing.timed_iterator("template", chunked(pieces)),
+            media_type="text/html; charset=utf-8",
+            headers=cache_headers(etag),
+        )
+    with timing.timed("template"):
+        return templates.TemplateResponse(
+            "index.html", context, headers=cache_headers(etag)
+        )
+
+
 @app.get("/", response_class=HTMLResponse)
-async def index(
+async def index(request: Request):
+    tree = await crud.get_tree_cached()
+    return tree_response(request, tree, 0, len(tree.categories))
+
+
+@app.get("/tree/{category_id}", response_class=HTMLResponse)
+async def view_branch(request: Request, category_id: int):
+    tree = await crud.get_tree_cached()
+    start = get_position(tree, category_id)
+    end = subtree_end(tree.categories, start)
+    return tree_response(request, tree, start, end)
+
+
+@app.get("/api/categories")
+async def list_categories(
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    tree = await crud.get_tree_cached()
+    end = offset + limit
+    return {
+        "total": len(tree.categories),
+        "offset": offset,
+        "limit": limit,
+        "items": [node._asdict() for node in tree.categories[offset:end]],
+    }
+
+
+@app.get("/api/categories/{category_id}/children")
+async def list_children(category_id: int):
+    tree = await crud.get_tree_cached()
+    position = get_position(tree, category_id)
+    children = descendants(tree.categories, position, 1)
+    return [node._asdict() for node in children]
+
+
+@app.get("/api/categories/{category_id}/descendants")
+async def list_descendants(category_id: int, depth: int = Query(1, ge=1)):
+    tree = await crud.get_tree_cached()
+    position = get_position(tree, category_id)
+    nodes = descendants(tree.categories, position, depth)
+    return [node._asdict() for node in nodes]
+
+
+@app.get("/api/search")
+async def search_api(
+    q: str = Query(..., max_length=200),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+):
+    return await search.search_categories(q, offset, limit)
+
+
+@app.get("/search", response_class=HTMLResponse)
+async def search_page(
     request: Request,
-    session: AsyncSession = Depends(get_session),
+    q: str = Query("", max_length=200),
+    page: int = Query(1, ge=1),
 ):
-    categories = await get_categories_cached(session)
+    size = settings.SEARCH_PAGE_SIZE
+    results = await search.search_categories(q, (page - 1) * size, size)
+    pages = -(-results["total"] // size)
     return templates.TemplateResponse(
-        "index.html",
+        "search.html",
         {
             "request": request,
-            "categories": categories,
-            "indent": Markup("&nbsp;&nbsp;&nbsp;&nbsp;"),
+            "query": q,
+            "results": results,
+            "page": page,
+            "pages": pages,
         },
     )
 
 
-@app.get("/category/{category_id}", response_class=HTMLResponse)
-async def view_category(
+BULK_FORMAT = Query("ndjson", alias="format", pattern="^(ndjson|json)$")
+
+
+@app.get("/api/categories/export")
+async def export_categories(fmt: str = BULK_FORMAT):
+    chunks = bulk.EXPORTERS[fmt]()
+    return StreamingResponse(chunks, media_type=bulk.MEDIA_TYPES[fmt])
+
+
+@app.post("/api/categories/import")
+async def import_categories(
     request: Request,
-    category_id: int,
-    session: AsyncSession = Depends(get_session),
+    fmt: str = BULK_FORMAT,
+    parent_id: Optional[int] = None,
 ):
-    current_category = await session.get(Category, category_id)
-    categories = await get_categories_cached(session)
-    breadcrumbs = await crud.get_breadcrumbs(categories, category_id)
-    if current_category.link:
-        return RedirectResponse(current_category.link, status_code=303)
-    if current_category.content:
-        current_category.content = markdown2.markdown(
-            current_category.content, extras=["fenced-code-blocks", "tables"]
-        )
+    # ndjson is read as it arrives, a nested json tree has to be parsed
+    # as a whole
+    try:
+        if fmt == "ndjson":
+            rows = bulk.parse_ndjson(bulk.iter_lines(request.stream()))
+        else:
+            nodes = bulk.load_json(await request.body())
+            rows = bulk.iterate_async(nodes)
+        imported = await bulk.import_categories(rows, parent_id)
+    except bulk.BulkImportError as error:
+        raise HTTPException(status_code=422, detail=str(error))
+    return {"imported": imported}
+
+
+async def render_page(
+    request: Request,
+    category: CategoryEntry,
+    breadcrumbs: List[CategoryNode],
+) -> bytes:
+    # older rows have no content_html until backfill.py has run
+    content_html = category.content_html
+    if content_html is None:
+        with timing.timed("markdown"):
+            content_html = await render_pool.render(category.content)
+    with timing.timed("template"):
         return templates.TemplateResponse(
             "category.html",
             {
                 "request": request,
-                "category": current_category,
+                "category": category,
+                "content_html": content_html,
                 "breadcrumbs": breadcrumbs,
             },
+        ).body
+
+
+@app.get("/category/{category_id}", response_class=HTMLResponse)
+async def view_category(request: Request, category_id: int):
+    base_url = str(request.base_url)
+    page = local_cache.get_page(category_id, base_url)
+    if page is None:
+        generation = local_cache.generation
+        category = await crud.get_category_entry(category_id)
+        if category is None:
+            raise HTTPException(status_code=404)
+        if category.link:
+            return RedirectResponse(category.link, status_code=303)
+        if not (category.content_html or category.content):
+            return RedirectResponse("/", status_code=303)
+        tree = await crud.get_tree_cached()
+        breadcrumbs = tree.nodes(category.path)
+        if breadcrumbs is None:
+            breadcrumbs = await crud.get_breadcrumbs(category_id)
+        etag = make_etag(
+            request,
+            category.content_html or category.content,
+            *(f"{crumb.id}:{crumb.name}" for crumb in breadcrumbs),
         )
-    return RedirectResponse("/", status_code=303)
+    else:
+        etag = page.etag
+    warmup.record_view(category_id)
+    if is_not_modified(request, etag):
+        # no rendering for a 304, the next full GET caches the page
+        return not_modified(etag)
+    if page is None:
+        body = await render_page(request, category, breadcrumbs)
+        page = RenderedPage(etag, body, base_url, tree.version)
+        local_cache.set_page(category_id, page, generation)
+    return HTMLResponse(page.body, headers=cache_headers(etag))
 
 
 @app.post("/category/{category_id}/update")
 async def update_category(
     category_id: int,
     name: str = Form(...),
+    content: Optional[str] = Form(None),
     session: AsyncSession = Depends(get_session),
 ):
-    await crud.update_category(session, category_id, name)
+    await crud.update_category(session, category_id, name, content)
     return RedirectResponse(f"/category/{category_id}", status_code=303)
 
 
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import os
+import socket
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional
+
+from server import redis_
+from server.settings import Settings
+
+settings = Settings()
+
+# upper bounds in seconds, the last bucket is +Inf
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+CONTENT_TYPE = "text/plain; version=0.0.4"
+# snapshots of workers that stopped pushing expire after a few intervals
+WORKER_KEY = "metrics:worker:{}"
+WORKER_TTL_INTERVALS = 3
+
+# name -> labels -> value; labels are already rendered, 'route="/"'
+Series = Dict[str, Dict[str, float]]
+# name -> labels -> count per bucket, then the sum and the count
+HistogramSeries = Dict[str, Dict[str, List[float]]]
+
+
+def render_labels(labels: Optional[dict]) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        pairs.append(f'{key}="{value}"')
+    return ",".join(pairs)
+
+
+def render_value(value: float) -> str:
+    # repr keeps every digit, "g" would round big counters
+    return repr(float(value))
+
+
+class Registry:
+    def __init__(self, worker: str):
+        self.worker = worker
+        self.counters: Series = defaultdict(dict)
+        self.histograms: HistogramSeries = defaultdict(dict)
+        # called on every snapshot to add what other modules count already
+        # (cache, pool and listener stats) without counting it twice
+        self.collectors: List[Callable[["Snapshot"], None]] = []
+
+    def inc(self, name: str, labels: Optional[dict] = None, value=1.0):
+        series = self.counters[name]
+        key = render_labels(labels)
+        series[key] = series.get(key, 0.0) + value
+
+    def observe(
+        self,
+        name: str,
+        seconds: float,
+        labels: Optional[dict] = None,
+    ):
+        series = self.histograms[name]
+        key = render_labels(labels)
+        values = series.get(key)
+        if values is None:
+            values = series[key] = [0.0] * (len(BUCKETS) + 3)
+        bucket = 0
+        while bucket < len(BUCKETS) and seconds > BUCKETS[bucket]:
+            bucket += 1
+        values[bucket] += 1
+        values[-2] += seconds
+        values[-1] += 1
+
+    def snapshot(self) -> "Snapshot":
+        snapshot = Snapshot(
+            {name: dict(series) for name, series in self.counters.items()},
+            {
+                name: {key: list(values) for key, values in series.items()}
+                for name, series in self.histograms.items()
+            },
+            {},
+        )
+        for collect in self.collectors:
+            collect(snapshot)
+        return snapshot
+
+    def payload(self) -> dict:
+        return {"worker": self.worker, **self.snapshot().to_dict()}
+
+    async def push(self):
+        key = WORKER_KEY.format(self.worker)
+        ttl = settings.METRICS_PUSH_INTERVAL * WORKER_TTL_INTERVALS
+        data = json.dumps(self.payload())
+        await redis_.redis_client.set(key, data, px=int(ttl * 1000))
+
+    async def push_periodically(self):
+        while True:
+            try:
+                await self.push()
+            except Exception as error:
+                print(f"Pushing metrics failed: {error!r}")
+            await asyncio.sleep(settings.METRICS_PUSH_INTERVAL)
+
+
+class Snapshot:
+    def __init__(
+        self,
+        counters: Series,
+        histograms: HistogramSeries,
+        gauges: Series,
+    ):
+        self.counters = counters
+        self.histograms = histograms
+        self.gauges = gauges
+
+    def counter(self, name: str, value: float, labels: Optional[dict] = None):
+        series = self.counters.setdefault(name, {})
+        key = render_labels(labels)
+        series[key] = series.get(key, 0.0) + value
+
+    def gauge(self, name: str, value: float, labels: Optional[dict] = None):
+        self.gauges.setdefault(name, {})[render_labels(labels)] = value
+
+    def to_dict(self) -> dict:
+        return {
+            "counters": self.counters,
+            "histograms": self.histograms,
+            "gauges": self.gauges,
+        }
+
+    @classmethod
+    def combine(cls, payloads: Iterable[dict]) -> "Snapshot":
+        # every series keeps a worker label instead of being added up: a
+        # sum would go down whenever a worker leaves, which prometheus
+        # takes for a reset, while a series of its own just ends. Sum
+        # them in the query, sum by (route) (rate(...[5m]))
+        combined = cls({}, {}, {})
+        for payload in payloads:
+            worker = render_labels({"worker": payload["worker"]})
+            for kind in ("counters", "histograms", "gauges"):
+                target = getattr(combined, kind)
+                for name, series in payload[kind].items():
+                    labelled = target.setdefault(name, {})
+                    for key, value in series.items():
+                        labelled[f"{worker},{key}" if key else worker] = value
+        return combined
+
+    def render(self) -> str:
+        lines = []
+        for kind, series in (
+            ("counter", self.counters),
+            ("gauge", self.gauges),
+        ):
+            for name in sorted(series):
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in sorted(series[name].items()):
+                    labels = f"{{{key}}}" if key else ""
+                    lines.append(f"{name}{labels} {render_value(value)}")
+        for name in sorted(self.histograms):
+            lines.append(f"# TYPE {name} histogram")
+            for key, values in sorted(self.histograms[name].items()):
+                lines.extend(render_histogram(name, key, values))
+        return "\n".join(lines) + "\n"
+
+
+def render_histogram(name: str, key: str, values: List[float]) -> List[str]:
+    prefix = f"{key}," if key else ""
+    labels = f"{{{key}}}" if key else ""
+    lines = []
+    cumulative = 0.0
+    bounds = [f"{bound:g}" for bound in BUCKETS] + ["+Inf"]
+    for bound, count in zip(bounds, values):
+        cumulative += count
+        bucket_labels = f'{{{prefix}le="{bound}"}}'
+        count = render_value(cumulative)
+        lines.append(f"{name}_bucket{bucket_labels} {count}")
+    lines.append(f"{name}_sum{labels} {render_value(values[-2])}")
+    lines.append(f"{name}_count{labels} {render_value(values[-1])}")
+    return lines
+
+
+async def collect_workers() -> Snapshot:
+    # every worker's last push, this one's fresh
+    try:
+        await registry.push()
+        keys = []
+        pattern = WORKER_KEY.format("*")
+        async for key in redis_.redis_client.scan_iter(pattern, count=100):
+            keys.append(key)
+        pushed = await redis_.redis_client.mget(keys) if keys else []
+    except redis_.UNAVAILABLE:
+        # the others can't be reached, this worker's own numbers only
+        return Snapshot.combine([registry.payload()])
+    return Snapshot.combine(json.loads(data) for data in pushed if data)
+
+
+registry = Registry(f"{socket.gethostname()}:{os.getpid()}")
@@ -1,7 +1,238 @@
+import asyncio
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
 import redis.asyncio as redis
+from redis.exceptions import ConnectionError, TimeoutError
 
 from server.settings import Settings
 
 settings = Settings()
 
-redis_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
+# errors of an unreachable or too slow redis, not of a wrong command
+UNAVAILABLE = (ConnectionError, TimeoutError)
+# set in the task that checks whether redis is back, the only one let
+# through while the circuit is open
+probing: ContextVar[bool] = ContextVar("probing", default=False)
+
+
+class CircuitOpenError(ConnectionError):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        failures: int,
+        reset_timeout: float,
+        probe: Callable[[], Awaitable],
+    ):
+        self.threshold = failures
+        self.reset_timeout = reset_timeout
+        self.probe = probe
+        self.failures = 0
+        self.open = False
+        self.recovering: Optional[asyncio.Task] = None
+        self.stats = {
+            "open": False,
+            "opened": 0,
+            "rejected": 0,
+            "failures": 0,
+            "last_error": None,
+        }
+
+    def success(self):
+        self.failures = 0
+
+    def failure(self, error: Exception):
+        # consecutive ones, a single slow command doesn't open it
+        self.failures += 1
+        self.stats["failures"] += 1
+        self.stats["last_error"] = repr(error)
+        if self.failures >= self.threshold:
+            self.trip(error)
+
+    def trip(self, error: Exception):
+        if self.open:
+            return
+        print(f"Redis is unavailable, serving without it: {error!r}")
+        self.open = self.stats["open"] = True
+        self.stats["opened"] += 1
+        self.recovering = asyncio.create_task(self.recover())
+
+    def reject(self):
+        self.stats["rejected"] += 1
+        raise CircuitOpenError("Redis is unavailable, the circuit is open")
+
+    async def recover(self):
+        # requests don't wait for redis meanwhile, a single probe does
+        while True:
+            await asyncio.sleep(self.reset_timeout)
+            token = probing.set(True)
+            try:
+                await self.probe()
+                break
+            except Exception as error:
+                self.stats["last_error"] = repr(error)
+            finally:
+                probing.reset(token)
+        print("Redis is available again")
+        self.failures = 0
+        self.open = self.stats["open"] = False
+        self.recovering = None
+
+
+class GuardedConnectionPool(redis.BlockingConnectionPool):
+    # pipelines, locks and scripts take their connections here as well
+    async def get_connection(self, *args, **kwargs):
+        if breaker.open and not probing.get():
+            breaker.reject()
+        return await super().get_connection(*args, **kwargs)
+
+
+class Redis(redis.Redis):
+    async def execute_command(self, *args, **options):
+        try:
+            result = await super().execute_command(*args, **options)
+        except CircuitOpenError:
+            raise
+        except UNAVAILABLE as error:
+            breaker.failure(error)
+            raise
+        breaker.success()
+        return result
+
+
+class PendingInvalidations:
+    # deletes, bumps and messages that failed while redis was unavailable.
+    # They only ever drop cached data, so replaying them late and out of
+    # order is safe; until then whatever redis holds may be stale, so a
+    # failed one opens the circuit
+    def __init__(self):
+        self.keys: Set[str] = set()
+        self.patterns: Set[str] = set()
+        self.counters: Set[str] = set()
+        # channel -> message replayed instead of the ones lost
+        self.messages: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        sets = (self.keys, self.patterns, self.counters, self.messages)
+        return sum(map(len, sets))
+
+    async def delete(self, *keys: str):
+        try:
+            await redis_client.delete(*keys)
+        except UNAVAILABLE as error:
+            self.keys.update(keys)
+            breaker.trip(error)
+
+    async def delete_and_bump(
+        self,
+        keys: List[str],
+        counters: List[str],
+        ttl: int,
+    ):
+        # the counters are versions writers check, they only have to
+        # outlive what was written under the previous one
+        try:
+            async with redis_client.pipeline() as pipe:
+                pipe.delete(*keys)
+                for counter in counters:
+                    pipe.incr(counter)
+                    pipe.expire(counter, ttl)
+                await pipe.execute()
+        except UNAVAILABLE as error:
+            self.keys.update(keys)
+            self.counters.update(counters)
+            breaker.trip(error)
+
+    async def delete_matching(self, pattern: str):
+        try:
+            await delete_matching(pattern)
+        except UNAVAILABLE as error:
+            self.patterns.add(pattern)
+            breaker.trip(error)
+
+    async def incr(self, key: str):
+        try:
+            await redis_client.incr(key)
+        except UNAVAILABLE as error:
+            self.counters.add(key)
+            breaker.trip(error)
+
+    async def publish(self, channel: str, message: str, replay: str):
+        try:
+            await redis_client.publish(channel, message)
+        except UNAVAILABLE as error:
+            self.messages[channel] = replay
+            breaker.trip(error)
+
+    async def replay(self):
+        await redis_client.ping()
+        # more may fail meanwhile, the circuit only closes once none is left
+        while len(self):
+            keys = list(self.keys)
+            if keys:
+                await redis_client.delete(*keys)
+                self.keys.difference_update(keys)
+            for pattern in list(self.patterns):
+                await delete_matching(pattern)
+                self.patterns.discard(pattern)
+            for key in list(self.counters):
+                await redis_client.incr(key)
+                self.counters.discard(key)
+            for channel, message in list(self.messages.items()):
+                await redis_client.publish(channel, message)
+                if self.messages.get(channel) == message:
+                    del self.messages[channel]
+
+
+async def delete_matching(pattern: str):
+    keys = []
+    async for key in redis_client.scan_iter(pattern, count=1000):
+        keys.append(key)
+    if keys:
+        await redis_client.delete(*keys)
+
+
+async def degraded(command: Awaitable, default=None):
+    # a cache read or write: default when redis is unavailable, the caller
+    # goes to postgres instead
+    try:
+        return await command
+    except UNAVAILABLE:
+        return default
+
+
+def snapshot() -> dict:
+    pool = redis_client.connection_pool
+    return {
+        **breaker.stats,
+        "pending_invalidations": len(pending),
+        "connections": len(pool._in_use_connections),
+        "max_connections": pool.max_connections,
+    }
+
+
+pending = PendingInvalidations()
+breaker = CircuitBreaker(
+    settings.REDIS_BREAKER_FAILURES,
+    settings.REDIS_BREAKER_RESET_TIMEOUT,
+    pending.replay,
+)
+# no retries: a command fails within the timeouts and the caller falls
+# back to postgres, instead of waiting for redis to come back
+pool = GuardedConnectionPool.from_url(
+    settings.REDIS_URL,
+    max_connections=settings.REDIS_MAX_CONNECTIONS,
+    timeout=settings.REDIS_POOL_TIMEOUT,
+    socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+    socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+)
+# the cached tree is binary, see codec.py
+redis_client = Redis.from_pool(pool)
+# subscriptions block on reads until a message comes, so no socket timeout
+pubsub_client = redis.from_url(
+    settings.REDIS_URL,
+    socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+)
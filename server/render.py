@@ -0,0 +1,120 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Iterable, Iterator, List, Optional
+
+import markdown2
+from markupsafe import Markup
+
+from server.settings import Settings
+
+settings = Settings()
+
+MARKDOWN_EXTRAS = ["fenced-code-blocks", "tables"]
+# jinja yields a piece per tag or expression, sent in chunks of this size
+STREAM_CHUNK_SIZE = 64 * 1024
+# in front of a category on tree pages, once per level below the first
+INDENT = "&nbsp;&nbsp;&nbsp;&nbsp; "
+
+
+class RenderQueueFull(Exception):
+    pass
+
+
+def render_markdown(content: Optional[str]) -> Optional[str]:
+    if not content:
+        return None
+    return markdown2.markdown(content, extras=MARKDOWN_EXTRAS)
+
+
+def render_all(contents: List[Optional[str]]) -> List[Optional[str]]:
+    return [render_markdown(content) for content in contents]
+
+
+class Indents(dict):
+    # the indent of each level, built the first time a level is rendered
+    # instead of looping over the levels of every category
+    def __init__(self, unit: str = INDENT):
+        super().__init__()
+        self.unit = Markup(unit)
+
+    def __missing__(self, level: int) -> Markup:
+        indent = self[level] = self.unit * level
+        return indent
+
+
+def chunked(
+    pieces: Iterable[str],
+    size: int = STREAM_CHUNK_SIZE,
+) -> Iterator[bytes]:
+    buffer = []
+    buffered = 0
+    for piece in pieces:
+        buffer.append(piece)
+        buffered += len(piece)
+        if buffered >= size:
+            yield "".join(buffer).encode()
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield "".join(buffer).encode()
+
+
+class RenderPool:
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        # renders running in the pool plus renders waiting for a process
+        self.limit = workers + queue_size
+        self.pending = 0
+        self.executor: Optional[Executor] = None
+
+    async def render(self, content: Optional[str]) -> Optional[str]:
+        if not content:
+            return None
+        if not self.workers:
+            return render_markdown(content)
+        return await self.submit(render_markdown, content)
+
+    async def render_many(
+        self,
+        contents: List[Optional[str]],
+    ) -> List[Optional[str]]:
+        # one job per worker, bulk imports don't fill the queue
+        if not self.workers or not contents:
+            return render_all(contents)
+        size = -(-len(contents) // self.workers)
+        chunks = []
+        for start in range(0, len(contents), size):
+            end = start + size
+            chunks.append(contents[start:end])
+        rendered = await asyncio.gather(
+            *(self.submit(render_all, chunk) for chunk in chunks)
+        )
+        return [html for chunk in rendered for html in chunk]
+
+    async def submit(self, func, argument):
+        if self.pending >= self.limit:
+            raise RenderQueueFull(f"{self.pending} renders already queued")
+
+        if self.executor is None:
+            # forked processes would inherit the listening socket of
+            # uvicorn and keep its port after the server is gone
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, func, argument
+            )
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+render_pool = RenderPool(settings.RENDER_WORKERS, settings.RENDER_QUEUE_SIZE)
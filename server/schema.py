@@ -1,5 +1,7 @@
-from typing import ForwardRef, List, Optional
+from typing import ForwardRef, List, NamedTuple, Optional
 
+from sqlalchemy import Column, Index, Integer
+from sqlalchemy.dialects.postgresql import ARRAY, TSVECTOR
 from sqlmodel import Field, Relationship, SQLModel
 
 CategoryRef = ForwardRef("Category")
@@ -16,7 +18,29 @@ class CategoryBase(SQLModel):
 
 
 class Category(CategoryBase, table=True):
+    __table_args__ = (
+        Index(
+            "ix_category_path",
+            "path",
+            unique=True,
+            postgresql_include=["id", "name", "parent_id"],
+        ),
+        Index("ix_category_search", "search", postgresql_using="gin"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
+    content_html: Optional[str] = Field(default=None)
+    # ids from the root down to this category, kept up to date by triggers
+    path: Optional[List[int]] = Field(
+        default=None,
+        sa_column=Column("path", ARRAY(Integer), nullable=False),
+    )
+    # weighted name and content for full-text search, set by a trigger
+    search: Optional[str] = Field(
+        default=None,
+        sa_column=Column("search", TSVECTOR, nullable=True),
+        exclude=True,
+    )
 
     parent: Optional[CategoryRef] = Relationship(
         back_populates="children",
@@ -37,6 +61,31 @@ class CategoryTree(SQLModel):
     )
 
 
+# a row of the cached tree; a plain tuple, since building a model for every
+# row was most of the cost of reading the tree from redis
+class CategoryNode(NamedTuple):
+    id: int
+    name: str
+    level: int
+    parent_id: Optional[int]
+
+
+# what a category page needs, cached per category; content is only kept
+# when there is no content_html to serve instead
+class CategoryEntry(NamedTuple):
+    id: int
+    name: str
+    parent_id: Optional[int]
+    link: Optional[str]
+    path: List[int]
+    content: Optional[str]
+    content_html: Optional[str]
+
+    def size(self) -> int:
+        texts = (self.name, self.link, self.content, self.content_html)
+        return sum(len(text) for text in texts if text)
+
+
 class CategoryUpdate(CategoryBase):
     id: Optional[int] = Field(default=None, foreign_key="category.id")
     name: str = Field(max_length=40)
@@ -0,0 +1,139 @@
+import json
+from typing import List
+
+from markupsafe import escape
+from sqlalchemy import text
+
+from server import redis_
+from server.cache import content_version, local_cache
+from server.db import engine
+from server.settings import Settings
+from server.timing import timed
+
+settings = Settings()
+
+# bumped on every change of the categories, cached results of older
+# generations are never read again and expire
+GENERATION_KEY = "search:generation"
+# ts_headline marks matches with these, so the text around them can be
+# escaped before they become <mark> tags
+START_SEL, STOP_SEL = "\x02", "\x03"
+NAME_OPTIONS = f"StartSel={START_SEL}, StopSel={STOP_SEL}, HighlightAll=true"
+SNIPPET_OPTIONS = (
+    f"StartSel={START_SEL}, StopSel={STOP_SEL}, "
+    "MaxFragments=2, MaxWords=30, MinWords=10"
+)
+
+# the same configuration as the on_category_search trigger; only the first
+# max_matches rows found are ranked, ranking every article containing a
+# common word is what makes a search slow, and headlines are only built
+# for the rows of the requested page
+SEARCH_QUERY = text(
+    """
+    WITH matches AS (
+        SELECT c.id, c.name, c.content, c.search
+        FROM category c, websearch_to_tsquery('simple', :query) q(query)
+        WHERE c.search @@ q.query
+        LIMIT :max_matches
+    ), hits AS (
+        SELECT m.id, m.name, m.content,
+               ts_rank_cd(m.search, q.query) AS rank,
+               count(*) OVER () AS total
+        FROM matches m, websearch_to_tsquery('simple', :query) q(query)
+        ORDER BY rank DESC, m.id
+        LIMIT :limit OFFSET :offset
+    )
+    SELECT h.id, h.name, h.total,
+           ts_headline('simple', h.name, q.query, :name_options)
+               AS name_html,
+           ts_headline('simple', coalesce(h.content, ''), q.query,
+                       :snippet_options) AS snippet
+    FROM hits h, websearch_to_tsquery('simple', :query) q(query)
+    ORDER BY h.rank DESC, h.id;
+"""
+)
+
+
+def highlight(headline: str) -> str:
+    marked = str(escape(headline))
+    return marked.replace(START_SEL, "<mark>").replace(STOP_SEL, "</mark>")
+
+
+def normalize(query: str) -> str:
+    # "Foo  bar" and "foo bar" are the same search and share a cache entry
+    return " ".join(query.lower().split())
+
+
+def result_key(generation: bytes, query: str, offset: int, limit: int) -> str:
+    digest = content_version(query, str(offset), str(limit))
+    return f"search:{generation.decode()}:{digest}"
+
+
+async def query_categories(query: str, offset: int, limit: int) -> dict:
+    params = {
+        "query": query,
+        "offset": offset,
+        "limit": limit,
+        "max_matches": settings.SEARCH_MAX_MATCHES,
+        "name_options": NAME_OPTIONS,
+        "snippet_options": SNIPPET_OPTIONS,
+    }
+    with timed("db"):
+        async with engine.connect() as conn:
+            result = await conn.execute(SEARCH_QUERY, params)
+            rows = result.mappings().all()
+    items: List[dict] = [
+        {
+            "id": row["id"],
+            "name": row["name"],
+            "name_html": highlight(row["name_html"]),
+            "snippet": highlight(row["snippet"]),
+        }
+        for row in rows
+    ]
+    # unknown past the last page, there is no row to count with
+    total = rows[0]["total"] if rows else 0
+    return {
+        "total": total,
+        # there may be more matches than were ranked
+        "capped": total == settings.SEARCH_MAX_MATCHES,
+        "offset": offset,
+        "limit": limit,
+        "items": items,
+    }
+
+
+async def search_categories(query: str, offset: int, limit: int) -> dict:
+    query = normalize(query)
+    if not query:
+        return {
+            "total": 0,
+            "capped": False,
+            "offset": offset,
+            "limit": limit,
+            "items": [],
+        }
+    # read before the query: results of an edit made meanwhile are stored
+    # under a generation that is already outdated
+    try:
+        with timed("redis"):
+            generation = await redis_.redis_client.get(GENERATION_KEY)
+            key = result_key(generation or b"0", query, offset, limit)
+            cached = await redis_.redis_client.get(key)
+    except redis_.UNAVAILABLE:
+        # there's no knowing which results are still valid
+        return await query_categories(query, offset, limit)
+    local_cache.record("search", cached is not None)
+    if cached:
+        return json.loads(cached)
+    results = await query_categories(query, offset, limit)
+    with timed("redis"):
+        command = redis_.redis_client.set(
+            key, json.dumps(results), ex=settings.SEARCH_CACHE_TTL
+        )
+        await redis_.degraded(command)
+    return results
+
+
+async def invalidate_results():
+    await redis_.pending.incr(GENERATION_KEY)
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic_settings import BaseSettings
 
 from server.utility import singleton
@@ -13,6 +15,125 @@ class Settings(BaseSettings):
     REDIS_URL: str
     STATIC_DIRECTORY: str
 
+    # per uvicorn worker, so postgres sees workers * (size + overflow)
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_PRE_PING: bool = False
+    # prepared statements asyncpg keeps per connection, 0 disables them
+    # (needed behind pgbouncer in transaction mode)
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    DB_COMMAND_TIMEOUT: Optional[float] = None
+    # log every statement
+    DB_ECHO: bool = False
+
+    # static files are served under names with a hash of their content,
+    # with gzip/brotli variants and an immutable Cache-Control; built on
+    # startup in the system temp dir unless `python -m server.assets` put
+    # them in the build directory already. Off serves them as they are
+    STATIC_FINGERPRINT: bool = True
+    STATIC_BUILD_DIRECTORY: Optional[str] = None
+
+    # per uvicorn worker; a command that can't get a connection, connect or
+    # answer in time fails and the caller goes to postgres instead
+    REDIS_MAX_CONNECTIONS: int = 50
+    REDIS_POOL_TIMEOUT: float = 1.0
+    REDIS_CONNECT_TIMEOUT: float = 0.5
+    REDIS_SOCKET_TIMEOUT: float = 0.5
+    # after that many failures in a row redis isn't asked at all, until a
+    # probe every reset timeout finds it back
+    REDIS_BREAKER_FAILURES: int = 5
+    REDIS_BREAKER_RESET_TIMEOUT: float = 5.0
+
+    # processes rendering markdown, 0 renders inline in the event loop
+    RENDER_WORKERS: int = 2
+    RENDER_QUEUE_SIZE: int = 32
+
+    # how long other workers wait for the one rebuilding the tree
+    TREE_REBUILD_LOCK_TIMEOUT: float = 5.0
+    # answer with the previous tree while the new one is being built
+    SERVE_STALE_TREE: bool = False
+
+    # "every" worker listens and updates redis itself, or only the "leader"
+    # holding a postgres advisory lock does and tells the others through
+    # redis pub/sub; the rest try to take over every election interval
+    LISTENER_MODE: str = "every"
+    LISTENER_ELECTION_INTERVAL: float = 5.0
+
+    # notifications arriving within the window are applied together; a
+    # batch of more categories than the threshold drops the cached tree
+    # instead of splicing each of them in
+    LISTENER_COALESCE_WINDOW: float = 0.05
+    LISTENER_REBUILD_THRESHOLD: int = 100
+    # reconnect delays of the listener, doubled up to the maximum, and how
+    # often its idle connection is checked
+    LISTENER_BACKOFF_MIN: float = 0.5
+    LISTENER_BACKOFF_MAX: float = 30.0
+    LISTENER_KEEPALIVE: float = 10.0
+
+    # format of the tree cached in redis: json or columnar, compressed with
+    # none, zlib or lz4 (needs the lz4 package) at the given level
+    CACHE_CODEC: str = "columnar"
+    CACHE_COMPRESSION: str = "none"
+    CACHE_COMPRESSION_LEVEL: int = 1
+
+    # levels of the tree rendered on "/", deeper branches are linked to
+    # "/tree/{id}"; 0 renders the whole tree
+    INDEX_MAX_LEVEL: int = 0
+    # tree pages with more categories than this are streamed in chunks
+    # instead of being rendered as one string, 0 streams all of them
+    INDEX_STREAM_THRESHOLD: int = 10_000
+
+    # pages whose entries are loaded before a worker reports ready, the
+    # most viewed ones, and how often views are added up in redis
+    WARMUP_PAGES: int = 100
+    WARMUP_VIEWS_FLUSH_INTERVAL: float = 30.0
+
+    # compiled templates are stored in this directory (the system's temp
+    # directory when unset) for the next workers to load instead of
+    # compiling them; with auto reload every render checks the template
+    # files for changes
+    TEMPLATE_BYTECODE_CACHE: bool = True
+    TEMPLATE_CACHE_DIRECTORY: Optional[str] = None
+    TEMPLATE_AUTO_RELOAD: bool = True
+
+    # per category entries for pages: bytes of text kept in each worker,
+    # entries larger than CATEGORY_CACHE_ENTRY_BYTES are never cached, and
+    # seconds an entry lives in redis
+    CATEGORY_CACHE_BYTES: int = 32 * 1024 * 1024
+    CATEGORY_CACHE_ENTRY_BYTES: int = 256 * 1024
+    CATEGORY_CACHE_TTL: int = 24 * 60 * 60
+    # bytes of rendered category pages kept in each worker, pages over
+    # CATEGORY_CACHE_ENTRY_BYTES aren't kept
+    CATEGORY_PAGE_CACHE_BYTES: int = 32 * 1024 * 1024
+
+    # results per page of "/search", and seconds results of a query stay
+    # cached in redis (changes of the categories invalidate them earlier)
+    SEARCH_PAGE_SIZE: int = 20
+    SEARCH_CACHE_TTL: int = 5 * 60
+    # matches ranked per query; a query matching more ranks the first ones
+    # found and reports its total as at least this
+    SEARCH_MAX_MATCHES: int = 10_000
+
+    # time spent in redis, decoding, postgres, markdown and templates is
+    # sent in a Server-Timing header, and logged with requests slower than
+    # SLOW_REQUEST_SECONDS (0 turns the log off)
+    SERVER_TIMING: bool = False
+    SLOW_REQUEST_SECONDS: float = 1.0
+    # "?profile=1" answers with a sampling profile of the request (needs
+    # the pyinstrument package); never turn it on in production
+    PROFILING: bool = False
+    PROFILING_INTERVAL: float = 0.001
+
+    # request, stage, cache, pool and listener metrics on /metrics in the
+    # prometheus text format; every worker pushes its own to redis this
+    # often, and /metrics adds them up
+    METRICS: bool = True
+    METRICS_PUSH_INTERVAL: float = 5.0
+
+    # sent with the ETag of "/" and "/category/{id}" pages
+    PAGE_CACHE_CONTROL: str = "no-cache"
+
     def get_connection(self):
         user = self.POSTGRES_USER
         password = self.POSTGRES_PASSWORD
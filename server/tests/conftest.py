@@ -0,0 +1,25 @@
+import pytest
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def category_row(mocker):
+    # what crud.get_category_page returns; name is an argument of Mock
+    # itself, so it's set afterwards
+    def make(content: str = "text"):
+        row = mocker.Mock(
+            id=2,
+            parent_id=1,
+            link=None,
+            content=content,
+            content_html=f"<p>{content}</p>",
+            path=[1, 2],
+        )
+        row.name = "child"
+        return row
+
+    return make
@@ -5,6 +5,7 @@ from server.main import app
 
 
 @pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio", "trio"])
 async def test_root():
     async with AsyncClient(
         transport=ASGITransport(app=app), base_url="http://test"
@@ -0,0 +1,75 @@
+import gzip
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+from starlette.applications import Starlette
+from starlette.routing import Mount
+
+from server import assets
+
+CSS = b".category { color: black; }\n" * 50
+
+
+@pytest.fixture
+def built(tmp_path):
+    source = tmp_path / "static"
+    source.mkdir()
+    (source / "styles.css").write_bytes(CSS)
+    (source / "logo.png").write_bytes(b"\x89PNG" + b"\0" * 100)
+    target = tmp_path / "build"
+    manifest = assets.build_assets(str(source), str(target))
+    return source, target, assets.Assets(str(target), manifest)
+
+
+def test_build_fingerprints_and_compresses_text_only(built):
+    _, target, static = built
+    css = static.resolve("styles.css")
+    png = static.resolve("logo.png")
+
+    assert css.startswith("styles.") and css.endswith(".css")
+    assert gzip.decompress((target / f"{css}.gz").read_bytes()) == CSS
+    assert static.files[png] == []
+    assert static.resolve("missing.css") == "missing.css"
+
+
+def test_negotiate_prefers_brotli_and_respects_q():
+    both = ["br", "gzip"]
+    assert assets.negotiate("gzip, deflate, br", both) == "br"
+    assert assets.negotiate("gzip, br;q=0", both) == "gzip"
+    assert assets.negotiate("*", ["gzip"]) == "gzip"
+    assert assets.negotiate("identity", both) is None
+
+
+@pytest.mark.anyio
+async def test_fingerprinted_file_is_immutable_and_compressed(built):
+    source, _, static = built
+    files = assets.AssetFiles(static, directory=str(source))
+    app = Starlette(routes=[Mount("/static", files, name="static")])
+    css = static.resolve("styles.css")
+
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as ac:
+        gzipped = {"Accept-Encoding": "gzip"}
+        hashed = await ac.get(f"/static/{css}", headers=gzipped)
+        plain = await ac.get("/static/styles.css")
+
+    assert hashed.headers["content-encoding"] == "gzip"
+    assert hashed.headers["cache-control"] == assets.IMMUTABLE
+    assert hashed.headers["content-type"].startswith("text/css")
+    assert hashed.content == CSS
+    assert "immutable" not in plain.headers.get("cache-control", "")
+    assert plain.content == CSS
+
+
+def test_built_files_are_not_compressed_again(built, mocker):
+    source, target, static = built
+    compress = mocker.spy(assets, "compress")
+
+    manifest = assets.build_assets(str(source), str(target))
+
+    compress.assert_not_called()
+    css = static.resolve("styles.css")
+    assert manifest["styles.css"] == static.manifest["styles.css"]
+    assert "gzip" in manifest["styles.css"]["encodings"]
+    assert (target / css).exists()
@@ -0,0 +1,125 @@
+import asyncio
+import json
+
+import pytest
+
+from server import background, crud
+from server.cache import local_cache
+from server.schema import CategoryEntry
+
+
+@pytest.mark.anyio
+async def test_burst_is_applied_as_one_batch(mocker):
+    apply = mocker.patch.object(background, "apply_notifications")
+    listener = background.NotificationListener("postgresql://unused", "every")
+    for category_id in (1, 2, 1):
+        payload = json.dumps({"type": "delete", "id": category_id})
+        listener.on_notification(None, 0, "category", payload)
+
+    consumer = asyncio.create_task(listener.consume())
+    await asyncio.sleep(background.settings.LISTENER_COALESCE_WINDOW * 2)
+    consumer.cancel()
+
+    apply.assert_awaited_once()
+    assert apply.await_args.args[0] == [
+        {"type": "delete", "id": 1},
+        {"type": "delete", "id": 2},
+    ]
+    assert listener.snapshot()["queue_depth"] == 0
+    assert listener.snapshot()["batches"] == 1
+
+
+def test_events_are_merged_by_category():
+    events = background.merge_events(
+        [
+            {"type": "insert", "id": 1},
+            {"type": "insert", "id": 2},
+            {"type": "edit", "id": 1},
+        ]
+    )
+
+    assert events == [{"type": "edit", "id": 1}, {"type": "insert", "id": 2}]
+
+
+@pytest.mark.anyio
+async def test_leader_updates_redis_and_fans_out(mocker):
+    update = mocker.patch.object(background, "update_shared")
+    publish = mocker.AsyncMock()
+    mocker.patch.object(background.redis_.redis_client, "publish", publish)
+    listener = background.NotificationListener("postgresql://unused", "leader")
+    listener.on_notification(None, 0, "category", '{"type": "edit", "id": 3}')
+
+    consumer = asyncio.create_task(listener.consume())
+    await asyncio.sleep(background.settings.LISTENER_COALESCE_WINDOW * 2)
+    consumer.cancel()
+
+    update.assert_awaited_once_with([{"type": "edit", "id": 3}])
+    channel, message = publish.await_args.args
+    assert channel == background.FANOUT_CHANNEL
+    assert json.loads(message) == {"events": [{"type": "edit", "id": 3}]}
+
+
+@pytest.mark.anyio
+async def test_malformed_notifications_are_skipped(mocker):
+    apply = mocker.patch.object(background, "apply_notifications")
+    listener = background.NotificationListener("postgresql://unused", "every")
+    for payload in ("x", "1", '{"type": "edit"}', '{"type": "edit", "id": 4}'):
+        listener.on_notification(None, 0, "category", payload)
+
+    consumer = asyncio.create_task(listener.consume())
+    await asyncio.sleep(background.settings.LISTENER_COALESCE_WINDOW * 2)
+    consumer.cancel()
+
+    apply.assert_awaited_once_with([{"type": "edit", "id": 4}])
+    assert listener.snapshot()["malformed"] == 3
+
+
+@pytest.mark.anyio
+async def test_stopped_consumer_is_restarted(mocker):
+    mocker.patch.object(background.settings, "LISTENER_BACKOFF_MIN", 0.001)
+    listener = background.NotificationListener("postgresql://unused", "every")
+    runs = mocker.AsyncMock(side_effect=[RuntimeError("boom"), None, None])
+
+    supervisor = asyncio.create_task(listener.supervise("Consuming", runs))
+    while runs.await_count < 3:
+        await asyncio.sleep(0.001)
+    supervisor.cancel()
+
+    assert listener.snapshot()["restarts"] >= 2
+
+
+@pytest.mark.anyio
+async def test_entries_read_during_an_edit_are_not_kept(mocker):
+    old = CategoryEntry(
+        id=2,
+        name="child",
+        parent_id=1,
+        link=None,
+        path=[1, 2],
+        content=None,
+        content_html="<p>old</p>",
+    )
+    replied = asyncio.Event()
+
+    async def mget(*keys):
+        # redis still has the entry until update_shared deletes it
+        await replied.wait()
+        return [json.dumps(old._asdict()), b"1"]
+
+    async def update_shared(events):
+        # one read is in flight already, another starts meanwhile
+        readers.append(asyncio.create_task(crud.get_category_entry(2)))
+        replied.set()
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+    mocker.patch.object(background.redis_.redis_client, "mget", mget)
+    mocker.patch.object(background, "update_shared", update_shared)
+    local_cache.clear_entries()
+    readers = [asyncio.create_task(crud.get_category_entry(2))]
+    await asyncio.sleep(0)
+
+    await background.apply_notifications([{"type": "edit", "id": 2}])
+    await asyncio.gather(*readers)
+
+    assert 2 not in local_cache.entries
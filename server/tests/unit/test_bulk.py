@@ -0,0 +1,106 @@
+import json
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from server import bulk
+from server.main import app
+
+TREE = [
+    {
+        "name": "root",
+        "children": [
+            {"name": "a", "children": [{"name": "a1", "link": "/x"}]},
+            {"name": "b", "content": "text"},
+        ],
+    },
+    {"name": "other"},
+]
+
+
+def test_flatten_puts_parents_first():
+    rows = list(bulk.flatten(TREE))
+
+    assert [(row["id"], row["parent_id"], row["name"]) for row in rows] == [
+        (1, None, "root"),
+        (2, 1, "a"),
+        (3, 2, "a1"),
+        (4, 1, "b"),
+        (5, None, "other"),
+    ]
+    assert rows[2]["link"] == "/x"
+
+
+@pytest.mark.anyio
+async def test_lines_are_split_across_chunks():
+    chunks = bulk.iterate_async(
+        [b'{"id": 1, "name": "a"', b'}\n{"id"', b': 2, "name": "b"}']
+    )
+    rows = [row async for row in bulk.parse_ndjson(bulk.iter_lines(chunks))]
+
+    assert rows == [{"id": 1, "name": "a"}, {"id": 2, "name": "b"}]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "body",
+    [b'{"name": "a"}\n{"name": \xff}\n', b'{"name": "a"}\n{"id": 2}\n'],
+)
+async def test_bad_ndjson_lines_are_reported(body):
+    chunks = bulk.iterate_async([body])
+
+    with pytest.raises(bulk.BulkImportError, match="^line 2: "):
+        async for _ in bulk.parse_ndjson(bulk.iter_lines(chunks)):
+            pass
+
+
+def test_categories_without_a_name_are_reported():
+    nodes = [{"name": "root", "children": [{"name": "a"}, {"link": "/"}]}]
+
+    with pytest.raises(bulk.BulkImportError, match="^category 3: "):
+        list(bulk.load_json(json.dumps(nodes)))
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "fmt, body, detail",
+    [
+        ("ndjson", b'{"name": "a"}\n{"name"\n', "line 2: "),
+        ("json", b'{"name": "a"}', "expected a list of categories"),
+    ],
+)
+async def test_import_rejects_malformed_bodies(mocker, fmt, body, detail):
+    engine = mocker.patch.object(bulk, "engine")
+    conn = engine.begin.return_value.__aenter__.return_value
+    conn.execute = mocker.AsyncMock()
+
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as ac:
+        response = await ac.post(
+            "/api/categories/import", params={"format": fmt}, content=body
+        )
+
+    assert response.status_code == 422
+    assert response.json()["detail"].startswith(detail)
+
+
+@pytest.mark.anyio
+async def test_export_json_nests_rows(mocker):
+    rows = [
+        {**row, "level": level}
+        for row, level in zip(bulk.flatten(TREE), (0, 1, 2, 1, 0))
+    ]
+    export_rows = mocker.patch.object(bulk, "export_rows")
+    export_rows.return_value = bulk.iterate_async(rows)
+
+    exported = json.loads("".join([c async for c in bulk.export_json()]))
+
+    assert exported[0]["children"][0]["children"][0]["name"] == "a1"
+    assert exported[0]["children"][1]["content"] == "text"
+    assert exported[1] == {
+        "name": "other",
+        "content": None,
+        "link": None,
+        "children": [],
+    }
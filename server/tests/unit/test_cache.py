@@ -0,0 +1,273 @@
+import asyncio
+import json
+
+import fakeredis
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from server import crud, main, redis_
+from server.cache import LocalCache, RenderedPage, TreeSnapshot, local_cache
+from server.main import app
+from server.schema import CategoryEntry, CategoryNode
+
+TREE = [
+    {"id": 1, "name": "root", "level": 0, "parent_id": None},
+    {"id": 2, "name": "child", "level": 1, "parent_id": 1},
+]
+ENTRY = CategoryEntry(
+    id=2,
+    name="child",
+    parent_id=1,
+    link=None,
+    path=[1, 2],
+    content=None,
+    content_html="<p>text</p>",
+)
+
+
+@pytest.fixture
+def redis_get(mocker):
+    get = mocker.AsyncMock(return_value=json.dumps(TREE).encode())
+    mocker.patch.object(redis_.redis_client, "get", get)
+    return get
+
+
+@pytest.fixture(autouse=True)
+def clean_local_cache():
+    local_cache.invalidate()
+    local_cache.clear_entries()
+    yield
+    local_cache.invalidate()
+
+
+@pytest.mark.anyio
+async def test_local_tier_is_checked_before_redis(redis_get):
+    first = await crud.get_tree_cached()
+    second = await crud.get_tree_cached()
+
+    assert first.categories == [CategoryNode(**item) for item in TREE]
+    assert second is first
+    redis_get.assert_awaited_once()
+
+
+@pytest.mark.anyio
+async def test_invalidation_drops_local_tree(redis_get):
+    await crud.get_tree_cached()
+    local_cache.invalidate()
+    await crud.get_tree_cached()
+
+    assert redis_get.await_count == 2
+
+
+@pytest.mark.anyio
+async def test_concurrent_misses_share_one_load(redis_get):
+    trees = await asyncio.gather(*(crud.get_tree_cached() for _ in range(5)))
+
+    assert all(tree is trees[0] for tree in trees)
+    redis_get.assert_awaited_once()
+
+
+def test_stale_generation_is_not_stored():
+    generation = local_cache.generation
+    local_cache.invalidate()
+    local_cache.set_tree(TreeSnapshot("v1", []), generation)
+
+    assert local_cache.tree is None
+
+
+def test_page_is_served_only_with_its_tree():
+    page = RenderedPage('"etag"', b"<html>", "http://test/", "v1")
+    local_cache.set_tree(TreeSnapshot("v1", []), local_cache.generation)
+    local_cache.set_page(1, page, local_cache.generation)
+
+    assert local_cache.get_page(1, "http://test/") == page
+    assert local_cache.get_page(1, "http://other/") is None
+
+    local_cache.set_tree(TreeSnapshot("v2", []), local_cache.generation)
+    assert local_cache.get_page(1, "http://test/") is None
+    assert 1 not in local_cache.pages
+
+
+def test_pages_are_capped_by_size():
+    cache = LocalCache(30, 20, 30)
+    cache.set_tree(TreeSnapshot("v1", []), cache.generation)
+    for category_id in (1, 2, 3, 4):
+        page = RenderedPage("", b"x" * 10, "http://test/", "v1")
+        cache.set_page(category_id, page, cache.generation)
+    large = RenderedPage("", b"x" * 30, "http://test/", "v1")
+    cache.set_page(5, large, cache.generation)
+
+    assert list(cache.pages) == [2, 3, 4]
+    assert cache.pages.bytes == 30
+
+
+@pytest.mark.anyio
+async def test_index_answers_conditional_get_with_304(redis_get):
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as ac:
+        response = await ac.get("/")
+        etag = response.headers["etag"]
+        cached = await ac.get("/", headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == "no-cache"
+    assert cached.status_code == 304
+    assert cached.content == b""
+    redis_get.assert_awaited_once()
+
+
+def entry(category_id: int, text: str) -> CategoryEntry:
+    return ENTRY._replace(id=category_id, content_html=text)
+
+
+def test_entries_are_capped_by_size():
+    # "child" and 5 characters of html: 10 each
+    cache = LocalCache(30, 20, 30)
+    for category_id in (1, 2, 3):
+        cache.set_entry(entry(category_id, "x" * 5), cache.generation)
+    cache.get_entry(1)
+    cache.set_entry(entry(4, "x" * 5), cache.generation)
+    cache.set_entry(entry(5, "x" * 30), cache.generation)
+
+    assert list(cache.entries) == [3, 1, 4]
+    assert cache.entries.bytes == 30
+
+
+@pytest.mark.anyio
+async def test_category_entry_is_read_once(mocker, category_row):
+    row = category_row()
+    get_page = mocker.patch.object(crud, "get_category_page", return_value=row)
+    redis_get = mocker.AsyncMock(return_value=[None, None])
+    redis_set = mocker.AsyncMock()
+    mocker.patch.object(redis_.redis_client, "mget", redis_get)
+    mocker.patch.object(redis_.redis_client, "eval", redis_set)
+
+    first = await crud.get_category_entry(2)
+    second = await crud.get_category_entry(2)
+
+    assert first == ENTRY
+    assert second is first
+    get_page.assert_awaited_once_with(2)
+    assert redis_set.await_args.args[2:4] == ("category:2:v", "category:2")
+
+
+@pytest.mark.anyio
+async def test_entry_read_before_eviction_is_not_stored(mocker, category_row):
+    # a redis holding the entry and its version, as the script sees it
+    store = {"category:2:v": b"3"}
+
+    async def evict_while_reading(category_id):
+        # the leader evicts it while this worker still reads the old row
+        await crud.evict_category_entries([category_id])
+        return row
+
+    async def mget(*keys):
+        return [store.get(key) for key in keys]
+
+    async def pipeline_execute():
+        store["category:2:v"] = b"4"
+        store.pop("category:2", None)
+
+    async def cache_entry(script, numkeys, version_at, key, version, *args):
+        if store.get(version_at, b"0").decode() == version:
+            store[key] = args[0]
+
+    row = category_row("old")
+    mocker.patch.object(crud, "get_category_page", evict_while_reading)
+    mocker.patch.object(redis_.redis_client, "mget", mget)
+    mocker.patch.object(redis_.redis_client, "eval", cache_entry)
+    pipe = mocker.MagicMock()
+    commands = mocker.Mock(execute=pipeline_execute)
+    pipe.__aenter__.return_value = commands
+    mocker.patch.object(redis_.redis_client, "pipeline", return_value=pipe)
+
+    entry = await crud.get_category_entry(2)
+
+    assert entry.content_html == "<p>old</p>"
+    assert "category:2" not in store
+
+
+@pytest.mark.anyio
+async def test_category_page_takes_breadcrumbs_from_tree(redis_get, mocker):
+    get_entry = mocker.patch.object(crud, "get_category_entry")
+    get_entry.return_value = ENTRY
+    get_breadcrumbs = mocker.patch.object(crud, "get_breadcrumbs")
+
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as ac:
+        response = await ac.get("/category/2")
+        cached = await ac.get("/category/2")
+
+    assert response.status_code == 200
+    assert b'<a href="/category/1">root' in response.content
+    assert cached.content == response.content
+    get_entry.assert_awaited_once_with(2)
+    get_breadcrumbs.assert_not_called()
+
+
+@pytest.mark.anyio
+async def test_304_of_uncached_page_skips_rendering(redis_get, mocker):
+    mocker.patch.object(crud, "get_category_entry", return_value=ENTRY)
+
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as ac:
+        response = await ac.get("/category/2")
+        local_cache.pages.clear()
+        render_page = mocker.spy(main, "render_page")
+        headers = {"If-None-Match": response.headers["etag"]}
+        cached = await ac.get("/category/2", headers=headers)
+
+    assert cached.status_code == 304
+    render_page.assert_not_called()
+    assert 2 not in local_cache.pages
+
+
+@pytest.mark.anyio
+async def test_streamed_index_matches_rendered_one(redis_get, mocker):
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as ac:
+        rendered = await ac.get("/")
+        mocker.patch.object(main.settings, "INDEX_STREAM_THRESHOLD", 0)
+        streamed = await ac.get("/")
+
+    assert "content-length" in rendered.headers
+    assert "content-length" not in streamed.headers
+    assert streamed.headers["etag"] == rendered.headers["etag"]
+    assert streamed.text == rendered.text
+
+
+def test_template_version_follows_the_sources(mocker):
+    before = main.template_version()
+    edited = ("<p>edited</p>", None, None)
+    loader = main.environment.loader
+    mocker.patch.object(loader, "get_source", return_value=edited)
+
+    assert main.template_version() != before
+
+
+@pytest.mark.anyio
+async def test_concurrent_appliers_keep_the_cached_tree(mocker):
+    # every worker applies the same notification at once
+    client = fakeredis.FakeAsyncRedis()
+    nodes = [CategoryNode(**item) for item in TREE]
+    await client.set("categories", crud.dump_categories(nodes))
+    mocker.patch.object(redis_, "redis_client", client)
+    delete = mocker.patch.object(redis_.pending, "delete")
+
+    async def get_rows(category_ids):
+        await asyncio.sleep(0)
+        return {2: {"id": 2, "name": "renamed", "parent_id": 1}}
+
+    mocker.patch.object(crud, "get_category_rows", get_rows)
+    events = [{"type": "edit", "id": 2}]
+
+    appliers = [crud.apply_category_events(events) for _ in range(6)]
+    await asyncio.gather(*appliers)
+
+    delete.assert_not_called()
+    tree = crud.load_categories(await client.get("categories"))
+    assert tree[1].name == "renamed"
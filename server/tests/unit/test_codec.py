@@ -0,0 +1,29 @@
+import json
+
+import pytest
+
+from server.codec import TreeCodec
+from server.schema import CategoryNode
+
+TREE = [
+    CategoryNode(1, "root", 0, None),
+    CategoryNode(2, "ветка", 1, 1),
+    CategoryNode(3, "", 2, 2),
+]
+
+
+@pytest.mark.parametrize("codec", ["json", "columnar"])
+@pytest.mark.parametrize("compression", ["none", "zlib"])
+def test_round_trip(codec, compression):
+    tree_codec = TreeCodec(codec, compression, 1)
+
+    assert tree_codec.decode(tree_codec.encode(TREE)) == TREE
+    assert tree_codec.decode(tree_codec.encode([])) == []
+
+
+def test_reads_payloads_of_other_settings():
+    payload = TreeCodec("json", "zlib", 1).encode(TREE)
+    legacy = json.dumps([node._asdict() for node in TREE]).encode()
+
+    assert TreeCodec("columnar", "none", 0).decode(payload) == TREE
+    assert TreeCodec("columnar", "none", 0).decode(legacy) == TREE
@@ -0,0 +1,53 @@
+import pytest
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from server.db import MeteredPool, PoolMetrics, pool_metrics
+
+
+class FakePool:
+    def size(self):
+        return 2
+
+    def checkedin(self):
+        return 1
+
+    def checkedout(self):
+        return 3
+
+    def overflow(self):
+        return 1
+
+
+def test_pool_metrics():
+    metrics = PoolMetrics()
+    metrics.record_wait(0.1, 0)
+    metrics.record_wait(0.3, 1)
+    metrics.connected_at[1] = 0.0
+
+    snapshot = metrics.snapshot(FakePool())
+
+    assert snapshot["checkouts"] == 2
+    assert snapshot["overflow_checkouts"] == 1
+    assert snapshot["wait_seconds_max"] == 0.3
+    assert round(snapshot["wait_seconds_mean"], 6) == 0.2
+    assert snapshot["connections"] == 1
+    assert snapshot["connection_age_seconds_max"] > 0
+    assert snapshot["checked_out"] == 3
+
+
+def test_only_pool_timeouts_are_counted_as_timeouts(mocker):
+    pool = MeteredPool(lambda: None)
+    get = mocker.patch.object(AsyncAdaptedQueuePool, "_do_get")
+    mocker.patch.object(pool_metrics, "timeouts", 0)
+    mocker.patch.object(pool_metrics, "connect_errors", 0)
+
+    get.side_effect = TimeoutError("QueuePool limit reached")
+    with pytest.raises(TimeoutError):
+        pool._do_get()
+    get.side_effect = OSError("Connection refused")
+    with pytest.raises(OSError):
+        pool._do_get()
+
+    assert pool_metrics.timeouts == 1
+    assert pool_metrics.connect_errors == 1
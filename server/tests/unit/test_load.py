@@ -0,0 +1,28 @@
+from server.benchmarks.load import failures, parse_budgets
+from server.benchmarks.synthetic import generate_categories
+
+
+def test_generated_tree_has_depth_and_fanout():
+    rows = list(generate_categories(200, depth=3, fanout=4, words=20))
+    levels = {}
+    children = {}
+    for row in rows:
+        parent = row["parent_id"]
+        # parents come first, bulk imports rely on it
+        levels[row["id"]] = levels[parent] + 1 if parent else 0
+        children[parent] = children.get(parent, 0) + 1
+        assert row["content"].startswith("# ")
+
+    assert len(rows) == 200
+    assert max(levels.values()) == 2
+    assert max(count for parent, count in children.items() if parent) == 4
+
+
+def test_results_over_budget_fail():
+    budgets = parse_budgets(["index.p99_ms=50"])
+    result = {"p50_ms": 10.0, "p99_ms": 80.0, "rps": 1.0}
+
+    assert list(failures("index", result, budgets["index"])) == [
+        "index p99_ms 80.0 > 50.0",
+        "index rps 1.0 < 10.0",
+    ]
@@ -0,0 +1,86 @@
+import json
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from server import metrics, redis_
+from server.main import app
+
+
+def payloads(*registries):
+    # as they come back from redis
+    return [json.loads(json.dumps(r.payload())) for r in registries]
+
+
+def series(text: str) -> dict:
+    values = {}
+    for line in text.splitlines():
+        if not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            values[name] = float(value)
+    return values
+
+
+def test_workers_keep_series_of_their_own():
+    first = metrics.Registry("a")
+    second = metrics.Registry("b")
+    for registry, seconds in ((first, 0.003), (second, 0.3)):
+        registry.inc("http_requests_total", {"route": "/"})
+        registry.observe("duration_seconds", seconds)
+    first.inc("http_requests_total", {"route": "/"})
+
+    text = metrics.Snapshot.combine(payloads(first, second)).render()
+
+    assert 'http_requests_total{worker="a",route="/"} 2.0' in text
+    assert 'http_requests_total{worker="b",route="/"} 1.0' in text
+    # cumulative buckets
+    assert 'duration_seconds_bucket{worker="a",le="0.0025"} 0.0' in text
+    assert 'duration_seconds_bucket{worker="a",le="0.005"} 1.0' in text
+    assert 'duration_seconds_bucket{worker="b",le="0.5"} 1.0' in text
+    assert 'duration_seconds_bucket{worker="b",le="+Inf"} 1.0' in text
+    assert 'duration_seconds_count{worker="b"} 1.0' in text
+
+
+def test_no_series_goes_down_when_a_worker_leaves():
+    first = metrics.Registry("a")
+    second = metrics.Registry("b")
+    for registry in (first, second):
+        registry.inc("http_requests_total", {"route": "/"}, 5)
+        registry.observe("duration_seconds", 0.01)
+    before = series(metrics.Snapshot.combine(payloads(first, second)).render())
+
+    # b's key expired, a kept counting
+    first.inc("http_requests_total", {"route": "/"})
+    after = series(metrics.Snapshot.combine(payloads(first)).render())
+
+    assert all(after[name] >= before[name] for name in after)
+    assert after['http_requests_total{worker="a",route="/"}'] == 6.0
+    assert not any('worker="b"' in name for name in after)
+
+
+def test_big_counters_keep_every_digit():
+    registry = metrics.Registry("a")
+    registry.inc("requests_total", value=1234567)
+    assert "requests_total 1234567.0" in registry.snapshot().render()
+
+
+@pytest.mark.anyio
+async def test_metrics_endpoint_counts_requests(mocker):
+    mocker.patch.object(metrics, "registry", metrics.Registry("test"))
+    mocker.patch.object(redis_.redis_client, "set", mocker.AsyncMock())
+    combine = metrics.Snapshot.combine
+    collect = mocker.AsyncMock(
+        side_effect=lambda: combine([metrics.registry.payload()])
+    )
+    mocker.patch.object(metrics, "collect_workers", collect)
+    mocker.patch("server.timing.registry", metrics.registry)
+
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as ac:
+        await ac.get("/nowhere")
+        response = await ac.get("/metrics")
+
+    assert response.headers["content-type"].startswith("text/plain")
+    labels = 'worker="test",route="unmatched",method="GET",status="404"'
+    assert f"http_requests_total{{{labels}}} 1.0" in response.text
@@ -0,0 +1,69 @@
+import pytest
+from redis.exceptions import ConnectionError
+
+from server import crud, redis_
+from server.cache import local_cache
+
+
+@pytest.fixture
+def breaker(mocker):
+    pending = redis_.PendingInvalidations()
+    breaker = redis_.CircuitBreaker(3, 0.01, pending.replay)
+    mocker.patch.object(redis_, "pending", pending)
+    mocker.patch.object(redis_, "breaker", breaker)
+    return breaker
+
+
+@pytest.mark.anyio
+async def test_only_failures_in_a_row_open_the_circuit(breaker):
+    error = ConnectionError("down")
+    breaker.failure(error)
+    breaker.failure(error)
+    breaker.success()
+    breaker.failure(error)
+    assert not breaker.open
+
+    breaker.failure(error)
+    breaker.failure(error)
+    assert breaker.open
+    breaker.recovering.cancel()
+
+
+@pytest.mark.anyio
+async def test_failed_invalidation_is_replayed(breaker, mocker):
+    delete = mocker.AsyncMock(side_effect=[ConnectionError("down"), 1])
+    mocker.patch.object(redis_.redis_client, "delete", delete)
+    mocker.patch.object(redis_.redis_client, "ping", mocker.AsyncMock())
+
+    await redis_.pending.delete("categories")
+
+    # nothing is read from redis while it may be stale
+    assert breaker.open
+    with pytest.raises(redis_.CircuitOpenError):
+        await redis_.pool.get_connection()
+
+    await breaker.recovering
+    assert not breaker.open
+    assert len(redis_.pending) == 0
+    assert [call.args for call in delete.await_args_list] == [
+        ("categories",),
+        ("categories",),
+    ]
+
+
+@pytest.mark.anyio
+async def test_entry_is_read_from_postgres_without_redis(mocker, category_row):
+    local_cache.clear()
+    row = category_row()
+    get_page = mocker.patch.object(crud, "get_category_page", return_value=row)
+    unavailable = mocker.AsyncMock(side_effect=ConnectionError("down"))
+    mocker.patch.object(redis_.redis_client, "mget", unavailable)
+    mocker.patch.object(redis_.redis_client, "eval", unavailable)
+
+    entry = await crud.get_category_entry(2)
+
+    assert entry.content_html == "<p>text</p>"
+    get_page.assert_awaited_once_with(2)
+    # the version is unknown, the row isn't written back
+    unavailable.assert_awaited_once()
+    local_cache.clear()
@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+from markupsafe import escape
+
+from server import bulk, crud
+from server.main import app
+from server.render import Indents, RenderPool, RenderQueueFull
+
+PARAGRAPH = "Lorem ipsum dolor sit amet, consectetur adipiscing elit.\n\n"
+ARTICLE = PARAGRAPH * 35000
+
+
+@pytest.mark.anyio
+async def test_health_responds_while_article_renders():
+    pool = RenderPool(workers=1, queue_size=0)
+    try:
+        rendering = asyncio.create_task(pool.render(ARTICLE))
+        latencies = []
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as ac:
+            while not rendering.done():
+                started = time.perf_counter()
+                response = await ac.get("/health")
+                latencies.append(time.perf_counter() - started)
+                assert response.status_code == 200
+                await asyncio.sleep(0.05)
+
+        assert len(ARTICLE) > 2_000_000
+        assert len(latencies) > 5
+        assert max(latencies) < 0.25
+        assert (await rendering).startswith("<p>Lorem ipsum")
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.anyio
+async def test_render_fails_fast_when_queue_is_full():
+    pool = RenderPool(workers=1, queue_size=0)
+    try:
+        rendering = asyncio.create_task(pool.render(ARTICLE))
+        await asyncio.sleep(0)
+        with pytest.raises(RenderQueueFull):
+            await pool.render("# second")
+        await rendering
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.anyio
+async def test_writes_answer_503_when_queue_is_full(mocker):
+    full = RenderQueueFull("32 renders already queued")
+    mocker.patch.object(crud.render_pool, "render", side_effect=full)
+    mocker.patch.object(bulk.render_pool, "render_many", side_effect=full)
+    engine = mocker.patch.object(bulk, "engine")
+    conn = engine.begin.return_value.__aenter__.return_value
+    allocated = mocker.Mock()
+    allocated.scalars.return_value.all.return_value = [1]
+    conn.execute = mocker.AsyncMock(return_value=allocated)
+
+    rows = b'{"name": "new"}\n'
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as ac:
+        added = await ac.post("/add", data={"name": "new"})
+        imported = await ac.post("/api/categories/import", content=rows)
+
+    for response in (added, imported):
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "1"
+
+
+def test_indents_are_built_once_per_level():
+    indents = Indents("&nbsp;")
+
+    assert indents[0] == ""
+    assert indents[3] == "&nbsp;&nbsp;&nbsp;"
+    assert indents[3] is indents[3]
+    # markup, so autoescape leaves it alone
+    assert escape(indents[2]) == "&nbsp;&nbsp;"
@@ -0,0 +1,41 @@
+import json
+
+import pytest
+
+from server import redis_, search
+
+RESULTS = {"total": 1, "offset": 0, "limit": 20, "items": []}
+
+
+def test_headlines_are_escaped_before_marking():
+    headline = f"<b>{search.START_SEL}python{search.STOP_SEL}</b> & more"
+
+    assert search.highlight(headline) == (
+        "&lt;b&gt;<mark>python</mark>&lt;/b&gt; &amp; more"
+    )
+
+
+@pytest.mark.anyio
+async def test_results_are_cached_per_generation(mocker):
+    stored = {}
+
+    async def get(key):
+        return stored.get(key, b"7" if key == search.GENERATION_KEY else None)
+
+    async def set_(key, value, ex):
+        stored[key] = value
+
+    mocker.patch.object(redis_.redis_client, "get", get)
+    mocker.patch.object(redis_.redis_client, "set", set_)
+    query = mocker.patch.object(
+        search, "query_categories", mocker.AsyncMock(return_value=RESULTS)
+    )
+
+    first = await search.search_categories("Python  Tips", 0, 20)
+    second = await search.search_categories("python tips", 0, 20)
+
+    assert first == second == RESULTS
+    query.assert_awaited_once_with("python tips", 0, 20)
+    (key,) = stored
+    assert key.startswith("search:7:")
+    assert json.loads(stored[key]) == RESULTS
@@ -0,0 +1,40 @@
+import pytest
+from httpx import ASGITransport, AsyncClient
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+from server import timing
+
+
+async def page(request):
+    with timing.timed("db"):
+        pass
+    with timing.timed("db"):
+        pass
+    with timing.timed("template"):
+        return PlainTextResponse("ok")
+
+
+@pytest.mark.anyio
+async def test_stages_are_sent_and_slow_requests_logged(capsys):
+    middleware = timing.TimingMiddleware(Starlette(routes=[Route("/", page)]))
+    middleware.header = True
+    middleware.slow = 1e-9
+
+    async with AsyncClient(
+        transport=ASGITransport(app=middleware), base_url="http://test"
+    ) as ac:
+        response = await ac.get("/")
+
+    header = response.headers["server-timing"]
+    stages = [metric.split(";")[0] for metric in header.split(", ")]
+    assert stages == ["db", "template", "total"]
+    assert "Slow request GET /: db;dur=" in capsys.readouterr().out
+
+
+def test_nothing_is_recorded_outside_requests():
+    with timing.timed("db"):
+        pass
+
+    assert timing.stages.get() is None
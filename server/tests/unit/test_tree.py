@@ -0,0 +1,105 @@
+import random
+
+from server.schema import CategoryNode
+from server.tree import apply_row, descendants, top_levels
+
+
+def build(rows):
+    # what the recursive CTE returns: pre-order, siblings ordered by id
+    children = {}
+    for category_id, (name, parent_id) in sorted(rows.items()):
+        children.setdefault(parent_id, []).append(category_id)
+
+    tree = []
+
+    def walk(parent_id, level):
+        for category_id in children.get(parent_id, []):
+            name = rows[category_id][0]
+            tree.append(
+                CategoryNode(
+                    id=category_id,
+                    name=name,
+                    level=level,
+                    parent_id=parent_id,
+                )
+            )
+            walk(category_id, level + 1)
+
+    walk(None, 0)
+    return tree
+
+
+def row(rows, category_id):
+    if category_id not in rows:
+        return None
+    name, parent_id = rows[category_id]
+    return {"name": name, "parent_id": parent_id}
+
+
+def subtree_ids(rows, category_id):
+    found = {category_id}
+    changed = True
+    while changed:
+        changed = False
+        for child, (_, parent_id) in rows.items():
+            if parent_id in found and child not in found:
+                found.add(child)
+                changed = True
+    return found
+
+
+def test_random_changes_match_full_rebuild():
+    rng = random.Random(6)
+    rows = {}
+    tree = build(rows)
+    for step in range(600):
+        action = rng.random()
+        if not rows or action < 0.4:
+            category_id = max(rows, default=0) + 1
+            parent_id = rng.choice([None, *rows])
+            rows[category_id] = (f"new {step}", parent_id)
+        elif action < 0.6:
+            category_id = rng.choice(list(rows))
+            for child in subtree_ids(rows, category_id):
+                del rows[child]
+                tree = apply_row(tree, child, None)
+        elif action < 0.8:
+            category_id = rng.choice(list(rows))
+            rows[category_id] = (f"renamed {step}", rows[category_id][1])
+        else:
+            category_id = rng.choice(list(rows))
+            options = set(rows) - subtree_ids(rows, category_id)
+            parent_id = rng.choice([None, *options])
+            rows[category_id] = (rows[category_id][0], parent_id)
+
+        tree = apply_row(tree, category_id, row(rows, category_id))
+        assert tree == build(rows)
+
+
+def test_disagreement_with_database_is_reported():
+    tree = build({1: ("root", None), 2: ("child", 1)})
+
+    assert apply_row(tree, 3, {"name": "orphan", "parent_id": 42}) is None
+    assert apply_row(tree, 1, {"name": "root", "parent_id": 2}) is None
+
+
+def test_top_levels_cuts_off_deeper_branches():
+    tree = build(
+        {
+            1: ("root", None),
+            2: ("child", 1),
+            3: ("grandchild", 2),
+            4: ("leaf", 1),
+            5: ("other root", None),
+        }
+    )
+
+    visible = top_levels(tree, 0, len(tree), 2)
+    assert [(node.id, collapsed) for node, collapsed in visible] == [
+        (1, False),
+        (2, True),
+        (4, False),
+        (5, False),
+    ]
+    assert [node.id for node in descendants(tree, 0, 1)] == [2, 4]
+    assert [node.id for node in descendants(tree, 0, 2)] == [2, 3, 4]
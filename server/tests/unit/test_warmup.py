@@ -0,0 +1,33 @@
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from server import crud, redis_, warmup
+from server.main import app
+
+
+@pytest.mark.anyio
+async def test_ready_only_after_warm_up(mocker):
+    worker = warmup.Warmup(pages=2)
+    mocker.patch("server.main.warmup", worker)
+    tree = mocker.Mock(categories=[1, 2, 3])
+    mocker.patch.object(crud, "get_tree_cached", return_value=tree)
+    hottest = mocker.AsyncMock(return_value=[b"7", b"8"])
+    mocker.patch.object(redis_.redis_client, "zrevrange", hottest)
+    get_entry = mocker.patch.object(
+        crud, "get_category_entry", side_effect=[object(), None]
+    )
+    warmup.listener.synced.set()
+
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as ac:
+        cold = await ac.get("/ready")
+        await worker.run()
+        warm = await ac.get("/ready")
+
+    assert cold.status_code == 503
+    assert warm.status_code == 200
+    assert warm.json()["categories"] == 3
+    # the second one was deleted meanwhile
+    assert warm.json()["pages"] == 1
+    assert [call.args for call in get_entry.call_args_list] == [(7,), (8,)]
@@ -0,0 +1,158 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, Iterator, Optional
+from urllib.parse import parse_qs
+
+from starlette.datastructures import MutableHeaders
+
+from server.metrics import registry
+from server.settings import Settings
+
+try:
+    import pyinstrument
+except ImportError:  # optional, only needed for PROFILING
+    pyinstrument = None
+
+settings = Settings()
+
+# seconds spent in each stage by the current request, None when nothing
+# is recorded; the dict is shared with the threads a request runs code in
+Stages = Optional[Dict[str, float]]
+stages: ContextVar[Stages] = ContextVar("stages", default=None)
+
+
+@contextmanager
+def timed(stage: str):
+    recorded = stages.get()
+    if recorded is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        recorded[stage] = recorded.get(stage, 0.0) + elapsed
+
+
+def timed_iterator(stage: str, items: Iterable) -> Iterator:
+    # the time taken to produce each item, not to consume it
+    items = iter(items)
+    while True:
+        with timed(stage):
+            item = next(items, StopIteration)
+        if item is StopIteration:
+            return
+        yield item
+
+
+def format_stages(recorded: Dict[str, float], total: float) -> str:
+    metrics = []
+    for stage, seconds in recorded.items():
+        metrics.append(f"{stage};dur={seconds * 1000:.2f}")
+    metrics.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(metrics)
+
+
+def record_metrics(scope, status: int, recorded: Dict[str, float], total):
+    # by route template, not path, so every category shares one series;
+    # paths that match no route are counted together
+    route = scope.get("route")
+    labels = {
+        "route": route.path if route is not None else "unmatched",
+        "method": scope["method"],
+    }
+    registry.observe("http_request_duration_seconds", total, labels)
+    labels["status"] = status
+    registry.inc("http_requests_total", labels)
+    for stage, seconds in recorded.items():
+        registry.observe("stage_duration_seconds", seconds, {"stage": stage})
+
+
+class TimingMiddleware:
+    # the header has the stages up to the response headers, a streamed
+    # body is rendered after them; the slow request log and the metrics
+    # have all of them
+    def __init__(self, app):
+        self.app = app
+        self.header = settings.SERVER_TIMING
+        self.slow = settings.SLOW_REQUEST_SECONDS
+        self.metrics = settings.METRICS
+
+    async def __call__(self, scope, receive, send):
+        enabled = self.header or self.slow or self.metrics
+        if scope["type"] != "http" or not enabled:
+            await self.app(scope, receive, send)
+            return
+
+        recorded: Dict[str, float] = {}
+        token = stages.set(recorded)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_timed(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.header:
+                    total = time.perf_counter() - started
+                    timing = format_stages(recorded, total)
+                    headers = MutableHeaders(scope=message)
+                    headers.append("Server-Timing", timing)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            stages.reset(token)
+            total = time.perf_counter() - started
+            if self.metrics:
+                record_metrics(scope, status, recorded, total)
+            if self.slow and total > self.slow:
+                request = f"{scope['method']} {scope['path']}"
+                breakdown = format_stages(recorded, total)
+                print(f"Slow request {request}: {breakdown}")
+
+
+class ProfilerMiddleware:
+    # with PROFILING on, "?profile=1" answers with a sampling profile of
+    # the request instead of its response
+    def __init__(self, app):
+        self.app = app
+        self.enabled = settings.PROFILING
+        if self.enabled and pyinstrument is None:
+            raise RuntimeError("PROFILING needs the pyinstrument package")
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        query = parse_qs(scope["query_string"].decode())
+        if query.get("profile") != ["1"]:
+            await self.app(scope, receive, send)
+            return
+
+        async def discard(message):
+            pass
+
+        profiler = pyinstrument.Profiler(
+            interval=settings.PROFILING_INTERVAL, async_mode="enabled"
+        )
+        profiler.start()
+        try:
+            await self.app(scope, receive, discard)
+        finally:
+            profiler.stop()
+        body = profiler.output_html().encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/html; charset=utf-8"),
+                    (b"content-length", str(len(body)).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,118 @@
+from typing import Iterator, List, Optional, Tuple
+
+from server.schema import CategoryNode
+
+# The cached tree is the output of the recursive CTE: a pre-order walk where
+# siblings are ordered by id. Every function here keeps that order and
+# returns a new list, the old one may still be in use by other requests.
+
+
+def find(categories: List[CategoryNode], category_id: int) -> Optional[int]:
+    for index, category in enumerate(categories):
+        if category.id == category_id:
+            return index
+    return None
+
+
+def subtree_end(categories: List[CategoryNode], index: int) -> int:
+    level = categories[index].level
+    end = index + 1
+    while end < len(categories) and categories[end].level > level:
+        end += 1
+    return end
+
+
+def shift_level(category: CategoryNode, shift: int) -> CategoryNode:
+    return category._replace(level=category.level + shift)
+
+
+def descendants(
+    categories: List[CategoryNode],
+    index: int,
+    depth: int,
+) -> List[CategoryNode]:
+    max_level = categories[index].level + depth
+    start, end = index + 1, subtree_end(categories, index)
+    return [node for node in categories[start:end] if node.level <= max_level]
+
+
+def top_levels(
+    categories: List[CategoryNode],
+    start: int,
+    end: int,
+    max_depth: int,
+) -> Iterator[Tuple[CategoryNode, bool]]:
+    # nodes of categories[start:end] down to max_depth levels below the
+    # first one, each with whether it has children that were cut off;
+    # lazy, so a streamed page never holds a copy of the tree
+    base_level = categories[start].level if start < end else 0
+    position = start
+    while position < end:
+        node = categories[position]
+        if not max_depth or node.level - base_level < max_depth - 1:
+            yield node, False
+            position += 1
+        else:
+            after = subtree_end(categories, position)
+            yield node, after > position + 1
+            position = after
+
+
+def insert_position(
+    categories: List[CategoryNode],
+    parent_id: Optional[int],
+    category_id: int,
+) -> Optional[Tuple[int, int]]:
+    if parent_id is None:
+        start, end, level = 0, len(categories), 0
+    else:
+        parent = find(categories, parent_id)
+        if parent is None:
+            return None
+        start, end = parent + 1, subtree_end(categories, parent)
+        level = categories[parent].level + 1
+
+    for index in range(start, end):
+        sibling = categories[index]
+        if sibling.level == level and sibling.id > category_id:
+            return index, level
+    return end, level
+
+
+def apply_row(
+    categories: List[CategoryNode],
+    category_id: int,
+    row: Optional[dict],
+) -> Optional[List[CategoryNode]]:
+    # row is None when the category is gone from the database; None is
+    # returned when the tree and the database disagree
+    index = find(categories, category_id)
+    if index is None:
+        block = []
+        rest = categories
+    else:
+        end = subtree_end(categories, index)
+        block = categories[index:end]
+        rest = categories[:index] + categories[end:]
+
+    if row is None:
+        return rest
+
+    if block and block[0].parent_id == row["parent_id"]:
+        updated = block[0]._replace(name=row["name"])
+        return categories[:index] + [updated] + block[1:] + rest[index:]
+
+    found = insert_position(rest, row["parent_id"], category_id)
+    if found is None:
+        # the new parent is missing, or it sits inside the moved subtree
+        return None
+    position, level = found
+    moved = CategoryNode(
+        id=category_id,
+        name=row["name"],
+        level=level,
+        parent_id=row["parent_id"],
+    )
+    shift = level - block[0].level if block else 0
+    block = [moved] + [shift_level(child, shift) for child in block[1:]]
+    return rest[:position] + block + rest[position:]
@@ -0,0 +1,86 @@
+import asyncio
+import time
+from collections import Counter
+
+from server import crud, redis_
+from server.background import listener, next_backoff
+from server.settings import Settings
+
+settings = Settings()
+
+# views of category pages, summed over workers and deploys
+VIEWS_KEY = "category_views"
+# categories whose views are kept, the rest are trimmed on every flush
+VIEWS_KEPT = 10
+
+
+class Warmup:
+    def __init__(self, pages: int):
+        self.pages = pages
+        self.views: Counter = Counter()
+        self.ready = False
+        self.stats = {
+            "ready": False,
+            "attempts": 0,
+            "seconds": None,
+            "categories": 0,
+            "pages": 0,
+            "last_error": None,
+        }
+
+    def record_view(self, category_id: int):
+        self.views[category_id] += 1
+
+    async def flush_views(self):
+        views, self.views = self.views, Counter()
+        if not views:
+            return
+        async with redis_.redis_client.pipeline(transaction=False) as pipe:
+            for category_id, count in views.items():
+                pipe.zincrby(VIEWS_KEY, count, category_id)
+            pipe.zremrangebyrank(VIEWS_KEY, 0, -self.pages * VIEWS_KEPT - 1)
+            await pipe.execute()
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(settings.WARMUP_VIEWS_FLUSH_INTERVAL)
+            try:
+                await self.flush_views()
+            except Exception as error:
+                print(f"Flushing category views failed: {error!r}")
+
+    async def warm(self):
+        # the tree from redis, or the query when nobody built it yet, and
+        # the entries of the most viewed pages into both cache tiers
+        tree = await crud.get_tree_cached()
+        self.stats["categories"] = len(tree.categories)
+        last = self.pages - 1
+        command = redis_.redis_client.zrevrange(VIEWS_KEY, 0, last)
+        # without redis the tree is enough to serve
+        hottest = await redis_.degraded(command, [])
+        pages = 0
+        for category_id in hottest:
+            if await crud.get_category_entry(int(category_id)) is not None:
+                pages += 1
+        self.stats["pages"] = pages
+
+    async def run(self):
+        # whatever is cached before the listener's first resync is dropped
+        await listener.synced.wait()
+        started = time.monotonic()
+        backoff = settings.LISTENER_BACKOFF_MIN
+        while True:
+            self.stats["attempts"] += 1
+            try:
+                await self.warm()
+                break
+            except Exception as error:
+                self.stats["last_error"] = repr(error)
+                print(f"Warm-up failed: {error!r}")
+            await asyncio.sleep(backoff)
+            backoff = next_backoff(backoff)
+        self.stats["seconds"] = time.monotonic() - started
+        self.ready = self.stats["ready"] = True
+
+
+warmup = Warmup(settings.WARMUP_PAGES)